@@ -1,18 +1,40 @@
 import os
 import re
-import shutil
-import asyncio
+import gzip
 import json
+import copy
+import base64
+import bisect
+import asyncio
+import hashlib
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any, NamedTuple, Set, Tuple
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Path as FastApiPath, Response, Body
-from pydantic import BaseModel, Field
-from starlette.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Path as FastApiPath, Response, Body, Request, Query, Depends
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, create_model
+from starlette.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
+import build as site_build
+import image_gc
+import image_metadata
+import metrics
+import search_index
+from storage import Snapshot, StorageError, get_repository
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available.
+    brotli = None
+
 # --- Configuration ---
 BASE_DIR = Path(__file__).resolve().parent
 IMAGES_DIR = BASE_DIR / "images"
@@ -21,8 +43,32 @@ DATA_DIR = BASE_DIR / "src/data"
 PROJEKTY_JSON_PATH = DATA_DIR / "projekty.json"
 VYSTAVY_JSON_PATH = DATA_DIR / "vystavy.json"
 PAINTINGS_JSON_PATH = DATA_DIR / "paintings.json"
-PYTHON_EXECUTABLE = "python3"
-BUILD_SCRIPT_PATH = BASE_DIR / "build.py"
+# Builds requested within this many seconds of each other are coalesced into one.
+BUILD_DEBOUNCE_SECONDS = float(os.environ.get("BUILD_DEBOUNCE_SECONDS", "1.0"))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# Room for the form fields and multipart boundaries of an upload request, on top of its file.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Set to "0" to serve list responses uncompressed (e.g. when a proxy compresses them).
+LIST_RESPONSE_COMPRESSION = os.environ.get("LIST_RESPONSE_COMPRESSION", "1") != "0"
+COMPRESSION_MIN_BYTES = 1024
+MAX_PAGE_SIZE = 500
+# 'order' values are spaced this far apart, so a move fits between its neighbours without renumbering.
+ORDER_STEP = 1024
+# A move that leaves a gap smaller than this schedules a background renumbering.
+REBALANCE_GAP = 8
+# Serialized responses kept for filtered, paginated or projected list queries (least recently used are dropped).
+LIST_QUERY_CACHE_SIZE = 256
+# Items accepted by one bulk request, and uploads of a bulk request streamed to disk at once.
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", "200"))
+BULK_UPLOAD_CONCURRENCY = 4
+# Whole POST /paintings/bulk requests, which carry many files, are limited to this many bytes.
+MAX_BULK_REQUEST_BYTES = int(os.environ.get("MAX_BULK_REQUEST_BYTES", str(10 * MAX_UPLOAD_BYTES)))
+# GET /events: how often data versions and build stats are checked while clients are connected,
+# the interval of keep-alive comments, and the events buffered per client before it is dropped.
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", "1.0"))
+EVENTS_HEARTBEAT_SECONDS = 15.0
+EVENTS_QUEUE_SIZE = 256
 
 # Create directories
 PAINTING_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
@@ -35,10 +81,30 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 class ReorderPayload(BaseModel):
     ids: List[int]
 
+class MovePayload(BaseModel):
+    before: Optional[int] = Field(None, description="Id of the item to place this one directly before")
+    after: Optional[int] = Field(None, description="Id of the item to place this one directly after")
+
+class BulkOperation(BaseModel):
+    op: Literal["update", "delete"]
+    id: int
+    data: Optional[Dict[str, Any]] = Field(None, description="Fields to change (update only)")
+
+class BulkPayload(BaseModel):
+    operations: List[BulkOperation] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS)
+
 class Link(BaseModel):
     url: str
     text: str
 
+class ImageInfo(BaseModel):
+    width: int
+    height: int
+    orientation: int
+    format: Optional[str] = None
+    sha256: str
+    color: str = Field(..., description="Dominant colour as #rrggbb")
+
 class PaintingBase(BaseModel):
     id: int
     order: int
@@ -46,6 +112,7 @@ class PaintingBase(BaseModel):
     sold: bool
     filename: str
     url: str
+    image_info: Optional[ImageInfo] = None
 
 class PaintingUpdate(BaseModel):
     title: Optional[str] = Field(None)
@@ -60,6 +127,7 @@ class ProjectBase(BaseModel):
     description: Optional[str] = None
     links: List[Link] = []
     video_url: Optional[str] = None
+    image_info: Optional[ImageInfo] = None
 
 class ProjectCreate(BaseModel):
     title: str = Field(...)
@@ -79,6 +147,7 @@ class ExhibitionBase(BaseModel):
     title: str
     image: Optional[str] = None
     links: List[Link] = []
+    image_info: Optional[ImageInfo] = None
 
 class ExhibitionCreate(BaseModel):
     title: str = Field(...)
@@ -89,40 +158,225 @@ class ExhibitionCreate(BaseModel):
 class ExhibitionUpdate(ExhibitionCreate): # <-- ADDED BACK
     pass
 
-# --- Helper Functions ---
-def load_data(filepath: Path) -> List[Dict[str, Any]]:
-    if not filepath.is_file(): return []
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f: data = json.load(f)
-        return data if isinstance(data, list) else []
-    except (json.JSONDecodeError, IOError): return []
+def patch_model(model):
+    """
+    A model of partial updates to `model`: its fields are optional but keep their types, and a
+    numeric 'order' may be set. Other fields pass through unchecked, as in PUT.
+    """
+    fields = {name: (field.annotation, None if field.is_required() else field.default) for name, field in model.model_fields.items()}
+    return create_model(f"{model.__name__}Patch", __config__=ConfigDict(extra="allow"), order=(int, None), **fields)
+
+# Bulk updates (and their previews) are validated against these before anything is written, so a
+# batch cannot store values, such as a non-numeric 'order', that break reading the resource.
+BULK_UPDATE_MODELS = {"paintings": PaintingUpdate, "projekty": patch_model(ProjectUpdate), "vystavy": patch_model(ExhibitionUpdate)}
 
-def save_data(filepath: Path, data: List[Dict[str, Any]]):
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# --- Data Repositories ---
+# Every load-modify-save cycle goes through repo.update() (see storage.py), which serializes
+# writers per file and writes atomically. Writes run in a worker thread via asyncio.to_thread.
+# Reads use repo.snapshot(), a cached and indexed view that must not be mutated.
+REPOSITORIES = {
+    "paintings": get_repository(PAINTINGS_JSON_PATH),
+    "projekty": get_repository(PROJEKTY_JSON_PATH),
+    "vystavy": get_repository(VYSTAVY_JSON_PATH),
+}
+paintings_repo = REPOSITORIES["paintings"]
 
+# --- Helper Functions ---
 def get_next_id(data: List[Dict[str, Any]]) -> int:
     if not data: return 1
     return max(item.get('id', 0) for item in data) + 1
 
-async def run_build_script(): # <-- ADDED BACK FULL FUNCTION
-    try:
-        process = await asyncio.create_subprocess_exec(
-            PYTHON_EXECUTABLE, str(BUILD_SCRIPT_PATH),
-            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
-            cwd=BASE_DIR
-        )
-        stdout, stderr = await process.communicate()
-        if process.returncode == 0:
-            print("Build script executed successfully.")
-        else:
-            print(f"Build script failed with error code {process.returncode}:\n{stderr.decode()}")
-    except Exception as e:
-        print(f"An error occurred while running the build script: {e}")
+def get_next_order(data: List[Dict[str, Any]]) -> int:
+    # New items go last, one ORDER_STEP after the current last item.
+    return max((item.get('order', 0) for item in data), default=-ORDER_STEP) + ORDER_STEP
+
+class BuildScheduler:
+    """
+    Coalesces build requests. At most one build runs at a time; requests arriving while
+    a build runs collapse into a single follow-up build, and every build waits until no
+    new request arrived for `debounce_seconds`.
+    With several API workers each has its own scheduler, but builds are serialized across
+    processes by build.py's lock, and a build is skipped when another worker's build already
+    started after the request (and so includes its changes).
+    """
+
+    def __init__(self, debounce_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self.queued = False
+        self.running = False
+        self.last_started_at: Optional[datetime] = None
+        self.last_finished_at: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_timings: Dict[str, float] = {}
+        self._last_request = 0.0
+        self._requested_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def request_build(self):
+        loop = asyncio.get_running_loop()
+        self.queued = True
+        self._last_request = loop.time()
+        self._requested_at = time.time()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._worker())
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while self.queued:
+            delay = self._last_request + self.debounce_seconds - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self.queued = False
+            await self._run_build(self._requested_at)
+
+    async def _run_build(self, requested_at: float):
+        # The build runs in-process on the warm SiteBuilder, in a worker thread so the event loop stays free.
+        self.running = True
+        self.last_started_at = datetime.now()
+        start = asyncio.get_running_loop().time()
+        try:
+            summary = await asyncio.to_thread(site_build.build, False, requested_at)
+            if summary is None:
+                print("Build skipped: another worker already built these changes.")
+                return
+            metrics.record_build(summary)
+            self.last_timings = summary['timings']
+            if summary['failed']:
+                self.last_error = f"Failed to render: {', '.join(summary['failed'])}"
+                print(f"Build finished with errors. {self.last_error}")
+            else:
+                self.last_error = None
+                print("Build script executed successfully.")
+        except Exception as e:
+            self.last_error = str(e)
+            metrics.record_build(site_build.load_build_stats())
+            print(f"An error occurred while running the build script: {e}")
+        finally:
+            self.running = False
+            self.last_finished_at = datetime.now()
+            self.last_duration = asyncio.get_running_loop().time() - start
+            event_broker.notify()
+
+    def depth(self) -> int:
+        return int(self.queued) + int(self.running)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "debounce_seconds": self.debounce_seconds,
+            "last_started_at": self.last_started_at.isoformat() if self.last_started_at else None,
+            "last_finished_at": self.last_finished_at.isoformat() if self.last_finished_at else None,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "last_timings": self.last_timings,
+            # The last build of any worker (or of the command line), from build.py's stats file.
+            "last_build": {k: v for k, v in (site_build.load_build_stats() or {}).items() if k in ("id", "status", "started_at", "finished_at", "duration")} or None,
+        }
+
+build_scheduler = BuildScheduler(BUILD_DEBOUNCE_SECONDS)
+
+class EventBroker:
+    """
+    Fans change events out to the clients of GET /events. While any client is connected, one
+    watcher task compares every repository's data version and the build stats file (which all
+    workers and command-line builds write) every `poll_seconds`, and right away after notify(),
+    so changes made by other workers or by hand are reported too.
+    """
+
+    def __init__(self, poll_seconds: float):
+        self.poll_seconds = poll_seconds
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._versions: Dict[str, str] = {}
+        self._build: Optional[Dict[str, Any]] = None
+        self._build_key: Optional[Tuple[str, str]] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _check(self, baseline: bool = False) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns the events since the last check (none for the baseline check, which only records
+        the current state). Runs in a worker thread, as it reads files.
+        """
+        events = []
+        for resource, repo in REPOSITORIES.items():
+            try: snapshot = repo.snapshot()
+            except StorageError: continue
+            if self._versions.get(resource) != snapshot.version:
+                self._versions[resource] = snapshot.version
+                events.append(("resource-changed", {"resource": resource, "version": snapshot.version, "modified": snapshot.modified}))
+        stats = site_build.load_build_stats()
+        key = (stats['id'], stats.get('status')) if stats and stats.get('id') else None
+        if key and key != self._build_key:
+            previous_id = self._build_key[0] if self._build_key else None
+            self._build_key, self._build = key, build_event(stats)
+            # A build that finished between two checks is reported as started, too.
+            if stats['id'] != previous_id: events.append(("build-started", build_event(stats, started=True)))
+            if stats.get('status') != 'running': events.append(("build-finished", build_event(stats)))
+        return [] if baseline else events
+
+    def state(self) -> Dict[str, Any]:
+        return {"versions": dict(self._versions), "build": self._build}
+
+    async def subscribe(self):
+        """Registers a client; returns its event queue and the current state."""
+        queue: asyncio.Queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._wake, self._ready = asyncio.Event(), asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+        try: await self._ready.wait()
+        except BaseException:
+            self._subscribers.discard(queue)
+            raise
+        return queue, self.state()
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def is_subscribed(self, queue: asyncio.Queue) -> bool:
+        return queue in self._subscribers
+
+    def notify(self):
+        if self._wake is not None: self._wake.set()
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        for queue in list(self._subscribers):
+            try: queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # A client that stopped reading is dropped; it gets the current state when it reconnects.
+                self._subscribers.discard(queue)
+
+    async def _watch(self):
+        self._versions, self._build, self._build_key = {}, None, None
+        try: await asyncio.to_thread(self._check, True)
+        finally: self._ready.set()
+        while self._subscribers:
+            try: await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            try: events = await asyncio.to_thread(self._check)
+            except Exception as e:
+                print(f"Could not check for changes: {e}")
+                continue
+            for event, data in events: self.publish(event, data)
+
+def build_event(stats: Dict[str, Any], started: bool = False) -> Dict[str, Any]:
+    if started: return {"id": stats['id'], "started_at": stats.get('started_at')}
+    event = {k: stats.get(k) for k in ("id", "status", "started_at", "finished_at", "duration")}
+    if stats.get('failed'): event['failed'] = stats['failed']
+    if stats.get('error'): event['error'] = stats['error']
+    return event
+
+event_broker = EventBroker(EVENTS_POLL_SECONDS)
 
 def trigger_build(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_build_script)
+    # Every write triggers a build, so this is also where GET /events learns about it.
+    event_broker.notify()
+    background_tasks.add_task(build_scheduler.request_build)
 
 def sanitize_filename(name: str) -> str:
     # Basic sanitize, can be improved
@@ -132,9 +386,314 @@ def get_full_image_url(filename: str) -> str:
     # This now refers to the main /images mount point
     return f"/images/obrazy/{filename}"
 
+# --- Upload Helpers ---
+class UploadSizeLimitMiddleware:
+    """
+    Rejects multipart requests larger than an upload may be with 413 before the form parser
+    spools them to a temporary file: by their Content-Length up front, and by counting the
+    body as it arrives for chunked requests or a Content-Length that understates the body.
+    store_upload still checks each file against MAX_UPLOAD_BYTES.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        content_type = dict(scope.get("headers") or []).get(b"content-type", b"")
+        if scope["type"] != "http" or not content_type.startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+        limit = MAX_BULK_REQUEST_BYTES if scope["path"].rstrip("/") == "/paintings/bulk" else MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+        detail = f"Request exceeds {limit} bytes"
+        try: declared = int(dict(scope["headers"]).get(b"content-length", b"0"))
+        except ValueError: declared = 0
+        if declared > limit:
+            await JSONResponse(status_code=413, content={"detail": detail}, headers={"Connection": "close"})(scope, receive, send)
+            return
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                # Raised inside the form parser, which passes HTTPExceptions on (see FastAPI's request handler).
+                if received > limit: raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+# Magic bytes of the accepted image formats, as (offset, bytes) pairs that must all match.
+IMAGE_SIGNATURES = [
+    [(0, b"\xff\xd8\xff")],                # JPEG
+    [(0, b"\x89PNG\r\n\x1a\n")],            # PNG
+    [(0, b"GIF87a")], [(0, b"GIF89a")],    # GIF
+    [(0, b"RIFF"), (8, b"WEBP")],          # WebP
+]
+
+def is_image_content(head: bytes) -> bool:
+    return any(
+        all(head[offset:offset + len(magic)] == magic for offset, magic in signature)
+        for signature in IMAGE_SIGNATURES
+    )
+
+class StoredUpload(NamedTuple):
+    path: Path
+    sha256: str
+    size: int
+    duplicate: bool
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+def find_duplicate(directory: Path, size: int, sha256: str) -> Optional[Path]:
+    # Only files of the same size are compared, and files the image metadata index knows
+    # (unchanged since it was written) are compared by their recorded hash without reading them.
+    index = image_index.refresh().entries
+    for entry in os.scandir(directory):
+        if not entry.is_file() or entry.name.startswith("."): continue
+        stat = entry.stat()
+        if stat.st_size != size: continue
+        known = index.get(image_metadata.relative_url(Path(entry.path)))
+        if image_metadata.is_current(known, stat) and known.get("sha256"):
+            if known["sha256"] == sha256: return Path(entry.path)
+        elif _hash_file(Path(entry.path)) == sha256: return Path(entry.path)
+    return None
+
+def _write_chunk(file_object, digest, chunk: bytes):
+    file_object.write(chunk)
+    digest.update(chunk)
+
+def _finish_temp_file(file_object):
+    file_object.flush()
+    os.fsync(file_object.fileno())
+    file_object.close()
+
+async def store_upload(upload: UploadFile, target: Path) -> StoredUpload:
+    """
+    Streams an upload into a temp file next to `target` without blocking the event loop,
+    enforcing MAX_UPLOAD_BYTES and checking the magic bytes, then renames it into place.
+    If the directory already holds a byte-identical file, that file is reused instead.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = await asyncio.to_thread(
+        tempfile.NamedTemporaryFile, dir=target.parent, prefix=".upload-", suffix=".part", delete=False
+    )
+    tmp_path = Path(tmp.name)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk: break
+            if size == 0 and not is_image_content(chunk):
+                raise HTTPException(status_code=415, detail="Uploaded file is not a supported image")
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+            await asyncio.to_thread(_write_chunk, tmp, digest, chunk)
+        if size == 0: raise HTTPException(status_code=415, detail="Uploaded file is empty")
+        await asyncio.to_thread(_finish_temp_file, tmp)
+        metrics.UPLOAD_BYTES.labels(resource=target.parent.name).inc(size)
+        sha256 = digest.hexdigest()
+        duplicate = await asyncio.to_thread(find_duplicate, target.parent, size, sha256)
+        if duplicate:
+            await asyncio.to_thread(os.remove, tmp_path)
+            return StoredUpload(duplicate, sha256, size, True)
+        await asyncio.to_thread(os.replace, tmp_path, target)
+        return StoredUpload(target, sha256, size, False)
+    except BaseException:
+        tmp.close()
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+# --- Conditional List Responses ---
+# List endpoints are serialized (and compressed) once per data version, then served from
+# memory with a strong ETag and Last-Modified, answering revalidations with 304.
+class ListBody:
+    def __init__(self, version: str, body: bytes, modified: float, headers: Optional[Dict[str, str]] = None):
+        self.version = version
+        self.headers = headers or {}
+        self.etag_base = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = formatdate(modified, usegmt=True)
+        self.modified = int(modified)
+        self._encoded = {"identity": body}
+
+    def etag(self, encoding: str) -> str:
+        # Each content-coding is a different representation, so it gets its own strong ETag.
+        return f'"{self.etag_base}"' if encoding == "identity" else f'"{self.etag_base}-{encoding}"'
+
+    def encoded(self, encoding: str) -> bytes:
+        if encoding not in self._encoded:
+            body = self._encoded["identity"]
+            if encoding == "br":
+                self._encoded[encoding] = brotli.compress(body)
+            else:
+                self._encoded[encoding] = gzip.compress(body, compresslevel=6, mtime=0)
+        return self._encoded[encoding]
+
+_list_bodies: "OrderedDict[str, ListBody]" = OrderedDict()
+
+def dump_json(content: Any) -> bytes:
+    # Same encoding as FastAPI's JSONResponse.
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def negotiate_encoding(accept_encoding: str, size: int) -> str:
+    if not LIST_RESPONSE_COMPRESSION or size < COMPRESSION_MIN_BYTES: return "identity"
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            if params and float(quality) <= 0: continue
+        except ValueError: pass
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted: return "br"
+    if "gzip" in accepted: return "gzip"
+    return "identity"
+
+def is_not_modified(request: Request, body: ListBody) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        known = {body.etag(encoding) for encoding in ("identity", "gzip", "br")}
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or bool(tags & known)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try: return parsedate_to_datetime(if_modified_since).timestamp() >= body.modified
+        except (TypeError, ValueError): return False
+    return False
+
+def list_response(request: Request, cache_key: str, snapshot: Snapshot, serialize, version: Optional[str] = None, modified: Optional[float] = None) -> Response:
+    """
+    Serves `serialize(snapshot)` for the snapshot's version (or `version` and `modified`, when
+    the body also depends on other inputs), serializing it at most once.
+    `serialize` returns the body, or (body, extra headers) for paginated lists.
+    """
+    version = version or snapshot.version
+    body = _list_bodies.get(cache_key)
+    if body is None or body.version != version:
+        result = serialize(snapshot)
+        content, extra_headers = result if isinstance(result, tuple) else (result, None)
+        body = ListBody(version, content, modified or snapshot.modified, extra_headers)
+        _list_bodies[cache_key] = body
+        while len(_list_bodies) > LIST_QUERY_CACHE_SIZE: _list_bodies.popitem(last=False)
+    else:
+        _list_bodies.move_to_end(cache_key)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), len(body.encoded("identity")))
+    headers = {
+        **body.headers,
+        "ETag": body.etag(encoding),
+        "Last-Modified": body.last_modified,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if is_not_modified(request, body):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity": headers["Content-Encoding"] = encoding
+    return Response(content=body.encoded(encoding), media_type="application/json", headers=headers)
+
+# --- List Queries ---
+# Lists can be paginated with an opaque cursor over the ('order', 'id') key, filtered and
+# projected to a subset of fields. Pages are cut from per-snapshot indexes (see Snapshot.derived),
+# so a request never re-sorts or scans the whole list. The cursor for the next page is sent in
+# the X-Next-Cursor header (and a Link header), so the body stays a plain list.
+class ListQuery(NamedTuple):
+    limit: Optional[int] = None
+    cursor: Optional[Tuple[Any, Any]] = None
+    sold: Optional[bool] = None
+    title_prefix: Optional[str] = None
+    fields: Optional[Tuple[str, ...]] = None
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in self)
+
+    def cache_key(self, resource: str) -> str:
+        return f"{resource}?{json.dumps(list(self), ensure_ascii=False)}"
+
+def encode_cursor(key: Tuple[Any, Any]) -> str:
+    return base64.urlsafe_b64encode(dump_json(list(key))).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Any, Any]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(key, list) and len(key) == 2 and all(isinstance(v, (int, float)) for v in key):
+            return tuple(key)
+    except (ValueError, TypeError): pass
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def list_query(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for the whole list"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    title_prefix: Optional[str] = Query(None, min_length=1, description="Case-insensitive title prefix"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,title,url"),
+) -> ListQuery:
+    return ListQuery(
+        limit=limit,
+        cursor=decode_cursor(cursor) if cursor else None,
+        title_prefix=title_prefix.casefold() if title_prefix else None,
+        fields=tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip())) if fields else None,
+    )
+
+def build_title_index(snapshot: Snapshot) -> List[Tuple[str, int]]:
+    return sorted((str(item.get('title') or '').casefold(), n) for n, item in enumerate(snapshot.ordered))
+
+def build_sold_index(snapshot: Snapshot) -> Dict[bool, List[int]]:
+    index = {True: [], False: []}
+    for n, item in enumerate(snapshot.ordered): index[bool(item.get('sold'))].append(n)
+    return index
+
+def select_positions(snapshot: Snapshot, query: ListQuery):
+    """Yields the positions in snapshot.ordered that match the query's filters, after its cursor."""
+    start = bisect.bisect_right(snapshot.keys, query.cursor) if query.cursor else 0
+    candidates, check_sold = None, query.sold is not None
+    if query.title_prefix:
+        index = snapshot.derived("title_index", build_title_index)
+        low = bisect.bisect_left(index, (query.title_prefix,))
+        high = bisect.bisect_left(index, (query.title_prefix + "\U0010ffff",))
+        candidates = sorted(n for _, n in index[low:high])
+    elif check_sold:
+        candidates, check_sold = snapshot.derived("sold_index", build_sold_index)[query.sold], False
+    positions = range(start, len(snapshot.ordered)) if candidates is None else candidates[bisect.bisect_left(candidates, start):]
+    for n in positions:
+        if not check_sold or bool(snapshot.ordered[n].get('sold')) == query.sold: yield n
+
+def query_serializer(request: Request, query: ListQuery, records):
+    """Returns a list_response serializer for one query; `records(snapshot)` is aligned with snapshot.ordered."""
+    def serialize(snapshot: Snapshot):
+        all_records = records(snapshot)
+        positions = select_positions(snapshot, query)
+        if query.limit is not None: positions = islice(positions, query.limit + 1)
+        page = list(positions)
+        headers = {}
+        if query.limit is not None and len(page) > query.limit:
+            page = page[:query.limit]
+            next_cursor = encode_cursor(snapshot.keys[page[-1]])
+            next_url = request.url.include_query_params(cursor=next_cursor)
+            headers = {"X-Next-Cursor": next_cursor, "Link": f'<{next_url.path}?{next_url.query}>; rel="next"'}
+        items = [all_records[n] for n in page]
+        if query.fields: items = [{f: item[f] for f in query.fields if f in item} for item in items]
+        return dump_json(items), headers
+    return serialize
+
+def check_fields(query: ListQuery, model) -> None:
+    unknown = [f for f in query.fields or () if f not in model.model_fields]
+    if unknown: raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
 # --- FastAPI Application ---
 app = FastAPI(title="Maří Magdalena Content API")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(UploadSizeLimitMiddleware)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor", "Link"])
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+@app.exception_handler(StorageError)
+async def storage_error_handler(request, exc: StorageError):
+    # A corrupt data file must not be mistaken for an empty one (and then overwritten).
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
 
 app.mount("/assets", StaticFiles(directory="dist/assets"), name="static")
 app.mount("/web", StaticFiles(directory="./", html=True), name="web")
@@ -142,161 +701,572 @@ app.mount("/web", StaticFiles(directory="./", html=True), name="web")
 @app.post("/build", status_code=202, summary="Manually trigger build script")
 async def trigger_manual_build(background_tasks: BackgroundTasks):
     """
-    Manually triggers the build.py script execution in the background.
+    Manually triggers a site build (see build.py) in the background.
     """
     trigger_build(background_tasks)
     return JSONResponse(content={"message": "Build process triggered."}, status_code=202)
 
+@app.get("/build/status", summary="Build scheduler state")
+async def get_build_status():
+    """
+    Returns whether a build is queued or running, and the duration, error and
+    per-phase timings of the last finished build.
+    """
+    return build_scheduler.status()
+
+def format_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+@app.get("/events", summary="Server-Sent Events for data and build changes")
+async def stream_events(request: Request):
+    """
+    A text/event-stream of changes, from any worker: 'resource-changed' with the resource and
+    its new data version, 'build-started' and 'build-finished' with the build's status and
+    duration. It opens with a 'ready' event holding the current versions and last build, so
+    clients that reconnect can refetch only the resources whose version changed.
+    """
+    queue, state = await event_broker.subscribe()
+
+    async def stream():
+        try:
+            yield f"retry: 3000\n{format_event('ready', state)}"
+            while event_broker.is_subscribed(queue) or not queue.empty():
+                try: event, data = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected(): break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            event_broker.unsubscribe(queue)
+
+    # X-Accel-Buffering stops nginx from buffering the stream when it proxies the API.
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics", summary="Prometheus metrics")
+async def get_metrics():
+    """
+    Request latencies, data file loads and saves, upload volume and build metrics in the
+    Prometheus text format. Builds run from the command line are picked up from their stats file.
+    """
+    metrics.BUILD_QUEUE_DEPTH.labels().set(build_scheduler.depth())
+    metrics.record_build(await asyncio.to_thread(site_build.load_build_stats))
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# --- Search ---
+# One in-memory index (see search_index.py) per worker, brought up to date on each search
+# with the records that changed since the last one.
+search = search_index.SearchIndex()
+
+def refresh_search():
+    for resource, repo in REPOSITORIES.items():
+        snapshot = repo.snapshot()
+        records = snapshot.ordered
+        if resource == "paintings": records = [{**p, 'url': get_full_image_url(p.get('filename', ''))} for p in records]
+        search.update(resource, records, snapshot.version)
+
+def run_search(q: str, resource: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    refresh_search()
+    return search.search(q, resource, limit)
+
+@app.get("/search", summary="Search paintings, projects and exhibitions")
+async def search_resources(q: str = Query(..., min_length=1), resource: Optional[str] = None, limit: int = Query(20, ge=1, le=100)):
+    """
+    Finds the items matching every word of `q` in their title (and the date/place and
+    description of projects and exhibitions), ignoring case and diacritics: "dobrany" finds
+    "Dobřany". Words also match as prefixes. Restrict to one resource with `resource`.
+    """
+    if resource is not None and resource not in REPOSITORIES: raise HTTPException(status_code=404, detail="Resource not found")
+    return {"query": q, "results": await asyncio.to_thread(run_search, q, resource, limit)}
+
+# --- Preview ---
+# Pages are rendered in memory by the build's warm SiteBuilder (see SiteBuilder.preview),
+# which caches them by the versions of their templates and data; nothing is written.
+PREVIEW_BASE = b'<base href="/web/">'
+
+def preview_records(patch: Dict[str, BulkPayload]) -> Dict[str, List[Dict[str, Any]]]:
+    """Applies a patch ({resource: operations, as for PATCH /{resource}/bulk}) to copies of the stored records."""
+    records = {}
+    for resource, payload in patch.items():
+        if resource not in REPOSITORIES: raise HTTPException(status_code=404, detail=f"Resource not found: {resource}")
+        operations = validate_bulk_operations(resource, payload)
+        items = copy.deepcopy(REPOSITORIES[resource].snapshot().items)
+        results, _ = apply_bulk_operations(items, operations)
+        missing = [result["id"] for result in results if result["status"] == 404]
+        if missing: raise HTTPException(status_code=404, detail=f"Items not found in {resource}: {', '.join(map(str, missing))}")
+        records[resource] = items
+    return records
+
+async def preview_response(request: Request, page: str, records: Dict[str, List[Dict[str, Any]]]) -> Response:
+    result = await asyncio.to_thread(site_build.get_builder().preview, page, records)
+    if result is None: raise HTTPException(status_code=404, detail="Page not found")
+    content, version = result
+    etag = f'"{version[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""): return Response(status_code=304, headers=headers)
+    if not page.endswith(".html"): return Response(content=content, media_type="application/json", headers=headers)
+    # Relative asset, image and link URLs resolve against the published site.
+    content = re.sub(rb"<head\b[^>]*>", lambda match: match.group(0) + PREVIEW_BASE, content, count=1)
+    return Response(content=content, media_type="text/html; charset=utf-8", headers=headers)
+
+@app.get("/preview/{page:path}", summary="Preview a page against the current data")
+async def preview_page(request: Request, page: str):
+    """
+    Renders one page of the site (e.g. `obrazy.html`, `galerie-2.html` or `galerie/2.json`)
+    from the templates in src/ and the current data, without waiting for or touching the build.
+    """
+    return await preview_response(request, page, {})
+
+@app.post("/preview/{page:path}", summary="Preview a page with unsaved changes")
+async def preview_page_with_patch(request: Request, page: str, patch: Dict[str, BulkPayload]):
+    """
+    Like GET /preview/{page}, with unsaved changes applied: the body maps resources to the
+    operations of PATCH /{resource}/bulk, e.g. {"paintings": {"operations": [{"op": "update",
+    "id": 3, "data": {"title": "New title"}}]}}. Nothing is saved.
+    """
+    return await preview_response(request, page, preview_records(patch))
+
 
 # --- Generic Reorder Endpoint ---
-def reorder_resource(filepath: Path, payload: ReorderPayload):
-    data = load_data(filepath)
+def reorder_resource(data: List[Dict[str, Any]], payload: ReorderPayload):
     data_map = {item['id']: item for item in data}
     reordered_data = []
     seen_ids = set()
     for i, item_id in enumerate(payload.ids):
         if item_id in data_map:
             item = data_map[item_id]
-            item['order'] = i
+            item['order'] = i * ORDER_STEP
             reordered_data.append(item)
             seen_ids.add(item_id)
     # Add any items that were not in the reorder payload to the end
     for item_id, item in data_map.items():
         if item_id not in seen_ids:
-            item['order'] = len(reordered_data)
+            item['order'] = len(reordered_data) * ORDER_STEP
             reordered_data.append(item)
-    save_data(filepath, reordered_data)
+    data[:] = reordered_data
+
+# --- Single-Item Move ---
+# Orders are sparse (ORDER_STEP apart), so moving an item only changes its own 'order' to a
+# value between its new neighbours. When a gap is used up the keys are renumbered: inline if
+# the move itself has no room left, otherwise in the background once gaps get small.
+def order_key(item: Dict[str, Any]):
+    return (item.get('order', 0), item.get('id') or 0)
+
+def rebalance_orders(data: List[Dict[str, Any]]):
+    for n, item in enumerate(sorted(data, key=order_key)):
+        item['order'] = n * ORDER_STEP
+
+def move_item(data: List[Dict[str, Any]], item_id: int, payload: MovePayload):
+    """Moves one item next to a neighbour. Returns (moved item, whether the keys need rebalancing)."""
+    by_id = {item.get('id'): item for item in data}
+    item = by_id.get(item_id)
+    if not item: raise HTTPException(status_code=404, detail="Item not found")
+    if payload.before is None and payload.after is None:
+        raise HTTPException(status_code=422, detail="Either 'before' or 'after' is required")
+    for neighbour_id in (payload.before, payload.after):
+        if neighbour_id == item_id: raise HTTPException(status_code=400, detail="An item cannot be moved next to itself")
+        if neighbour_id is not None and neighbour_id not in by_id: raise HTTPException(status_code=404, detail=f"Item {neighbour_id} not found")
+
+    others = [other for other in data if other is not item]
+    lower = by_id[payload.after] if payload.after is not None else None
+    upper = by_id[payload.before] if payload.before is not None else None
+    # With one neighbour given, the other is the item currently next to it.
+    if upper is None:
+        upper = min((o for o in others if order_key(o) > order_key(lower)), key=order_key, default=None)
+    if lower is None:
+        lower = max((o for o in others if order_key(o) < order_key(upper)), key=order_key, default=None)
+    if lower is not None and upper is not None and order_key(lower) >= order_key(upper):
+        raise HTTPException(status_code=400, detail="'after' must come before 'before'")
+
+    if lower is None: new_order = upper.get('order', 0) - ORDER_STEP
+    elif upper is None: new_order = lower.get('order', 0) + ORDER_STEP
+    elif upper.get('order', 0) - lower.get('order', 0) >= 2: new_order = (lower.get('order', 0) + upper.get('order', 0)) // 2
+    else:
+        # No integer left between the neighbours: renumber everything, then place the item.
+        rebalance_orders(others)
+        return move_item(data, item_id, payload)[0], False
+
+    item['order'] = new_order
+    gaps = [abs(new_order - n.get('order', 0)) for n in (lower, upper) if n is not None]
+    return dict(item), min(gaps) < REBALANCE_GAP
+
+async def rebalance_in_background(resource: str):
+    await asyncio.to_thread(REPOSITORIES[resource].update, rebalance_orders)
 
 # --- Reorder Endpoints ---
 @app.post("/{resource}/reorder", status_code=202)
 async def reorder_items(resource: str, payload: ReorderPayload, background_tasks: BackgroundTasks):
-    path_map = {
-        "paintings": PAINTINGS_JSON_PATH,
-        "projekty": PROJEKTY_JSON_PATH,
-        "vystavy": VYSTAVY_JSON_PATH,
-    }
-    if resource not in path_map:
+    """Bulk fallback that renumbers every item; prefer POST /{resource}/{id}/move for single moves."""
+    if resource not in REPOSITORIES:
         raise HTTPException(status_code=404, detail="Resource not found")
-    reorder_resource(path_map[resource], payload)
+    await asyncio.to_thread(REPOSITORIES[resource].update, lambda data: reorder_resource(data, payload))
     trigger_build(background_tasks)
     return {"message": f"{resource.capitalize()} reordered successfully."}
 
+@app.post("/{resource}/{item_id}/move", response_model=Dict)
+async def move_resource_item(resource: str, item_id: int, payload: MovePayload, background_tasks: BackgroundTasks):
+    """Moves one item directly before and/or after the given neighbours (in ascending 'order')."""
+    if resource not in REPOSITORIES:
+        raise HTTPException(status_code=404, detail="Resource not found")
+    item, needs_rebalance = await asyncio.to_thread(REPOSITORIES[resource].update, lambda data: move_item(data, item_id, payload))
+    # Renumbering keeps the relative order, so it needs no build of its own.
+    if needs_rebalance: background_tasks.add_task(rebalance_in_background, resource)
+    trigger_build(background_tasks)
+    image_index.refresh()
+    return painting_record(item) if resource == "paintings" else resource_record(item)
+
+# --- Bulk Endpoints ---
+# A batch is validated as a whole before anything is written, then applied in a single
+# repo.update() (one atomic save) followed by one build. Results are reported per item.
+def validate_bulk_operations(resource: str, payload: BulkPayload) -> List[BulkOperation]:
+    ids = [operation.id for operation in payload.operations]
+    duplicates = sorted({item_id for item_id in ids if ids.count(item_id) > 1})
+    if duplicates: raise HTTPException(status_code=400, detail=f"Duplicate ids in batch: {', '.join(map(str, duplicates))}")
+    errors, operations = [], []
+    for n, operation in enumerate(payload.operations):
+        if operation.op == "delete":
+            operations.append(operation)
+            continue
+        if not operation.data:
+            errors.append({"index": n, "detail": "Update requires data"})
+            continue
+        data = {k: v for k, v in operation.data.items() if k != 'id'}  # ids never change, as in PUT
+        try: data = BULK_UPDATE_MODELS[resource].model_validate(data).model_dump(exclude_unset=True)
+        except ValidationError as e:
+            errors.append({"index": n, "detail": e.errors(include_url=False, include_context=False)})
+            continue
+        operations.append(operation.model_copy(update={"data": data}))
+    if errors: raise HTTPException(status_code=422, detail=errors)
+    return operations
+
+def apply_bulk_operations(items: List[Dict[str, Any]], operations: List[BulkOperation]):
+    """Applies the operations to `items` in place; returns per-item results and the removed items."""
+    by_id = {item.get('id'): item for item in items}
+    results, deleted = [], {}
+    for operation in operations:
+        item = by_id.get(operation.id)
+        if item is None:
+            results.append({"id": operation.id, "status": 404, "detail": "Item not found"})
+        elif operation.op == "delete":
+            deleted[operation.id] = item
+            results.append({"id": operation.id, "status": 204})
+        else:
+            item.update(operation.data)
+            results.append({"id": operation.id, "status": 200, "item": dict(item)})
+    if deleted: items[:] = [item for item in items if item.get('id') not in deleted]
+    return results, list(deleted.values())
+
+def orphaned_painting_files(paintings: List[Dict[str, Any]], removed: List[Dict[str, Any]]) -> List[str]:
+    # Deduplicated uploads can share one file, so it is only removed with its last painting.
+    referenced = {p.get('filename') for p in paintings}
+    return sorted({p['filename'] for p in removed if p.get('filename') and p['filename'] not in referenced})
+
+def remove_painting_files(filenames: List[str]):
+    for filename in filenames:
+        try: os.remove(PAINTING_IMAGES_DIR / filename)
+        except OSError as e: print(f"Could not delete image file: {e}")
+
+@app.patch("/{resource}/bulk", response_model=Dict)
+async def bulk_update_resource(resource: str, payload: BulkPayload, background_tasks: BackgroundTasks):
+    """
+    Applies many updates and deletes to one resource in a single save, with one build. The batch
+    is rejected if any operation is malformed; ids that do not exist are reported with status 404
+    while the other operations still apply.
+    """
+    if resource not in REPOSITORIES:
+        raise HTTPException(status_code=404, detail="Resource not found")
+    operations = validate_bulk_operations(resource, payload)
+
+    def apply(items):
+        results, removed = apply_bulk_operations(items, operations)
+        orphaned = orphaned_painting_files(items, removed) if resource == "paintings" else []
+        return results, orphaned
+
+    results, orphaned = await asyncio.to_thread(REPOSITORIES[resource].update, apply)
+    remove_painting_files(orphaned)
+    if any(result["status"] < 400 for result in results): trigger_build(background_tasks)
+    image_index.refresh()
+    for result in results:
+        if "item" in result: result["item"] = painting_record(result["item"]) if resource == "paintings" else resource_record(result["item"])
+    return {"results": results}
+
+# --- Image Metadata ---
+# Records include the 'image_info' of their image from the image metadata index (see
+# image_metadata.py), which the build keeps up to date and uploads add to.
+image_index = image_metadata.MetadataCache()
+
+def image_info(url: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not url: return None
+    return image_metadata.public_fields(image_index.entries.get(url.lstrip("/")))
+
+def records_state(snapshot: Snapshot) -> Tuple[str, float]:
+    # Records change with the data and with the image index, so both make up their version and
+    # Last-Modified; otherwise If-Modified-Since would keep stale 'image_info' after an image changes.
+    image_index.refresh()
+    return f"{snapshot.version}:{image_index.version}", max(snapshot.modified, image_index.modified)
+
+def index_images(*paths: Path):
+    try: image_metadata.update_index(paths)
+    except Exception as e: print(f"Could not update the image metadata index: {e}")
+
 # --- Painting Endpoints ---
+paintings_adapter = TypeAdapter(List[PaintingBase])
+
+def painting_record(painting: Dict[str, Any]) -> Dict[str, Any]:
+    url = get_full_image_url(painting.get('filename', ''))
+    return {**painting, 'url': url, 'image_info': image_info(url)}
+
+def painting_records(snapshot: Snapshot) -> List[Dict[str, Any]]:
+    # Validated against PaintingBase once per data and image index version rather than on every request.
+    def validate(snapshot):
+        paintings = [painting_record(p) for p in snapshot.ordered]
+        return paintings_adapter.dump_python(paintings_adapter.validate_python(paintings))
+    return snapshot.derived(f"painting_records:{image_index.version}", validate)
+
+def serialize_paintings(snapshot: Snapshot) -> bytes:
+    return dump_json(painting_records(snapshot))
+
 @app.get("/paintings", response_model=List[PaintingBase])
-async def list_paintings():
-    paintings = sorted(load_data(PAINTINGS_JSON_PATH), key=lambda p: p.get('order', 0))
-    for p in paintings: p['url'] = get_full_image_url(p.get('filename', ''))
-    return paintings
+async def list_paintings(request: Request, query: ListQuery = Depends(list_query), sold: Optional[bool] = None):
+    """
+    Lists paintings by 'order'. Supports `limit`/`cursor` pagination, `sold` and `title_prefix`
+    filters and `fields` projection; see ListQuery.
+    """
+    query = query._replace(sold=sold)
+    snapshot = paintings_repo.snapshot()
+    version, modified = records_state(snapshot)
+    if query.is_empty(): return list_response(request, "paintings", snapshot, serialize_paintings, version, modified)
+    check_fields(query, PaintingBase)
+    return list_response(request, query.cache_key("paintings"), snapshot, query_serializer(request, query, painting_records), version, modified)
 
 @app.get("/paintings/{painting_id}", response_model=PaintingBase)
 async def get_painting(painting_id: int):
-    paintings = load_data(PAINTINGS_JSON_PATH)
-    painting = next((p for p in paintings if p.get('id') == painting_id), None)
+    painting = paintings_repo.snapshot().by_id.get(painting_id)
     if not painting: raise HTTPException(status_code=404, detail="Painting not found")
-    painting['url'] = get_full_image_url(painting.get('filename', ''))
-    return painting
+    image_index.refresh()
+    return painting_record(painting)
 
 @app.post("/paintings", response_model=PaintingBase, status_code=201)
 async def create_painting(background_tasks: BackgroundTasks, title: str = Form(...), sold: bool = Form(False), image: UploadFile = File(...)):
-    paintings = load_data(PAINTINGS_JSON_PATH)
-    new_id = get_next_id(paintings)
-    new_filename = f"{new_id}{Path(image.filename).suffix}"
-    file_location = PAINTING_IMAGES_DIR / new_filename
-    with open(file_location, "wb+") as file_object: shutil.copyfileobj(image.file, file_object)
-    new_painting = {"id": new_id, "title": title, "sold": sold, "order": len(paintings), "filename": new_filename}
-    paintings.append(new_painting)
-    save_data(PAINTINGS_JSON_PATH, paintings)
+    # The id is only known under the repository lock, so the upload is staged under a hidden name first.
+    suffix = Path(image.filename).suffix
+    stored = await store_upload(image, PAINTING_IMAGES_DIR / f".pending-{uuid.uuid4().hex}{suffix}")
+
+    def add_painting(paintings):
+        new_id = get_next_id(paintings)
+        new_filename = stored.path.name
+        if not stored.duplicate:
+            new_filename = f"{new_id}{suffix}"
+            os.replace(stored.path, PAINTING_IMAGES_DIR / new_filename)
+        new_painting = {"id": new_id, "title": title, "sold": sold, "order": get_next_order(paintings), "filename": new_filename}
+        paintings.append(new_painting)
+        return dict(new_painting)
+
+    try:
+        new_painting = await asyncio.to_thread(paintings_repo.update, add_painting)
+    except BaseException:
+        if not stored.duplicate and stored.path.exists(): os.remove(stored.path)
+        raise
+    if not stored.duplicate: background_tasks.add_task(index_images, PAINTING_IMAGES_DIR / new_painting['filename'])
     trigger_build(background_tasks)
-    new_painting['url'] = get_full_image_url(new_filename)
+    new_painting['url'] = get_full_image_url(new_painting['filename'])
     return new_painting
 
+@app.post("/paintings/bulk", response_model=Dict)
+async def bulk_create_paintings(
+    background_tasks: BackgroundTasks,
+    titles: List[str] = Form(...),
+    images: List[UploadFile] = File(...),
+    sold: Optional[List[bool]] = Form(None),
+):
+    """
+    Adds many paintings at once: `titles[i]` (and `sold[i]`, if given) describe `images[i]`.
+    The files are streamed to disk concurrently and all paintings are saved in one write with
+    one build. Files that are rejected (not an image, too large) are reported per item.
+    """
+    if len(images) > MAX_BULK_ITEMS: raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} paintings per batch")
+    if len(titles) != len(images) or (sold and len(sold) != len(images)):
+        raise HTTPException(status_code=400, detail="Each image needs a title (and a sold flag, if any are given)")
+    if not all(title.strip() for title in titles): raise HTTPException(status_code=400, detail="Titles must not be empty")
+    sold = sold or [False] * len(images)
+    suffixes = [Path(image.filename or "").suffix for image in images]
+    semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+
+    async def stage(image: UploadFile, suffix: str) -> StoredUpload:
+        async with semaphore:
+            return await store_upload(image, PAINTING_IMAGES_DIR / f".pending-{uuid.uuid4().hex}{suffix}")
+
+    outcomes = await asyncio.gather(*(stage(image, suffix) for image, suffix in zip(images, suffixes)), return_exceptions=True)
+    placed: List[Path] = []
+
+    def discard_files():
+        for path in [o.path for o in outcomes if isinstance(o, StoredUpload) and not o.duplicate] + placed:
+            try: os.remove(path)
+            except OSError: pass
+
+    unexpected = next((o for o in outcomes if isinstance(o, BaseException) and not isinstance(o, HTTPException)), None)
+    if unexpected is not None:
+        discard_files()
+        raise unexpected
+
+    def add_paintings(paintings):
+        created, filenames_by_hash = {}, {}
+        for n, stored in enumerate(outcomes):
+            if not isinstance(stored, StoredUpload): continue
+            new_id = get_next_id(paintings)
+            if stored.duplicate: new_filename = stored.path.name
+            elif stored.sha256 in filenames_by_hash:
+                # The same file twice in one batch: both paintings share the first copy.
+                os.remove(stored.path)
+                new_filename = filenames_by_hash[stored.sha256]
+            else:
+                new_filename = f"{new_id}{suffixes[n]}"
+                os.replace(stored.path, PAINTING_IMAGES_DIR / new_filename)
+                placed.append(PAINTING_IMAGES_DIR / new_filename)
+            filenames_by_hash.setdefault(stored.sha256, new_filename)
+            new_painting = {"id": new_id, "title": titles[n], "sold": sold[n], "order": get_next_order(paintings), "filename": new_filename}
+            paintings.append(new_painting)
+            created[n] = dict(new_painting)
+        return created
+
+    try:
+        created = await asyncio.to_thread(paintings_repo.update, add_paintings) if any(isinstance(o, StoredUpload) for o in outcomes) else {}
+    except BaseException:
+        discard_files()
+        raise
+    if created:
+        background_tasks.add_task(index_images, *placed)
+        trigger_build(background_tasks)
+    image_index.refresh()
+    results = []
+    for n, outcome in enumerate(outcomes):
+        if n in created: results.append({"index": n, "status": 201, "item": painting_record(created[n])})
+        else: results.append({"index": n, "status": outcome.status_code, "detail": outcome.detail})
+    return {"results": results}
+
 @app.put("/paintings/{painting_id}", response_model=PaintingBase)
 async def update_painting(background_tasks: BackgroundTasks, painting_id: int, update_data: PaintingUpdate):
-    paintings = load_data(PAINTINGS_JSON_PATH)
-    painting_index = next((i for i, p in enumerate(paintings) if p.get('id') == painting_id), -1)
-    if painting_index == -1: raise HTTPException(status_code=404, detail="Painting not found")
-    painting = paintings[painting_index]
-    painting.update(update_data.model_dump(exclude_unset=True))
-    save_data(PAINTINGS_JSON_PATH, paintings)
+    def apply_update(paintings):
+        painting = next((p for p in paintings if p.get('id') == painting_id), None)
+        if not painting: raise HTTPException(status_code=404, detail="Painting not found")
+        painting.update(update_data.model_dump(exclude_unset=True))
+        return dict(painting)
+
+    painting = await asyncio.to_thread(paintings_repo.update, apply_update)
     trigger_build(background_tasks)
     painting['url'] = get_full_image_url(painting.get('filename', ''))
     return painting
 
 @app.delete("/paintings/{painting_id}", status_code=204)
 async def delete_painting(background_tasks: BackgroundTasks, painting_id: int):
-    paintings = load_data(PAINTINGS_JSON_PATH)
-    painting_to_delete = next((p for p in paintings if p.get('id') == painting_id), None)
-    if not painting_to_delete: raise HTTPException(status_code=404, detail="Painting not found")
-    try: os.remove(PAINTING_IMAGES_DIR / painting_to_delete['filename'])
-    except OSError as e: print(f"Could not delete image file: {e}")
-    save_data(PAINTINGS_JSON_PATH, [p for p in paintings if p.get('id') != painting_id])
+    def remove_painting(paintings):
+        painting_to_delete = next((p for p in paintings if p.get('id') == painting_id), None)
+        if not painting_to_delete: raise HTTPException(status_code=404, detail="Painting not found")
+        paintings[:] = [p for p in paintings if p.get('id') != painting_id]
+        return orphaned_painting_files(paintings, [painting_to_delete])
+
+    remove_painting_files(await asyncio.to_thread(paintings_repo.update, remove_painting))
     trigger_build(background_tasks)
     return Response(status_code=204)
 
 # --- Project & Exhibition Endpoints ---
 # (Generic implementation for projekty and vystavy)
-RESOURCE_PATHS = {"projekty": PROJEKTY_JSON_PATH, "vystavy": VYSTAVY_JSON_PATH}
+RESOURCE_REPOSITORIES = {"projekty": REPOSITORIES["projekty"], "vystavy": REPOSITORIES["vystavy"]}
 RESOURCE_MODELS = {"projekty": (ProjectBase, ProjectUpdate), "vystavy": (ExhibitionBase, ExhibitionUpdate)}
 
+def resource_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {**item, 'image_info': image_info(item.get('image'))}
+
+def resource_records(snapshot: Snapshot) -> List[Dict[str, Any]]:
+    return snapshot.derived(f"resource_records:{image_index.version}", lambda snapshot: [resource_record(item) for item in snapshot.ordered])
+
 @app.get("/{resource}", response_model=List[Dict])
-async def list_resource(resource: str):
-    if resource not in RESOURCE_PATHS: raise HTTPException(status_code=404, detail="Resource not found")
-    return sorted(load_data(RESOURCE_PATHS[resource]), key=lambda p: p.get('order', 0))
+async def list_resource(request: Request, resource: str, query: ListQuery = Depends(list_query)):
+    """Lists items by 'order', with the pagination, `title_prefix` filter and `fields` projection of GET /paintings."""
+    if resource not in RESOURCE_REPOSITORIES: raise HTTPException(status_code=404, detail="Resource not found")
+    snapshot = RESOURCE_REPOSITORIES[resource].snapshot()
+    version, modified = records_state(snapshot)
+    if query.is_empty(): return list_response(request, resource, snapshot, lambda snapshot: dump_json(resource_records(snapshot)), version, modified)
+    check_fields(query, RESOURCE_MODELS[resource][0])
+    return list_response(request, query.cache_key(resource), snapshot, query_serializer(request, query, resource_records), version, modified)
 
 @app.post("/{resource}", response_model=Dict, status_code=201)
 async def create_resource(resource: str, data: Dict, background_tasks: BackgroundTasks):
-    if resource not in RESOURCE_PATHS: raise HTTPException(status_code=404, detail="Resource not found")
-    items = load_data(RESOURCE_PATHS[resource])
-    new_item = data
-    new_item['id'] = get_next_id(items)
-    new_item['order'] = len(items)
-    items.append(new_item)
-    save_data(RESOURCE_PATHS[resource], items)
+    if resource not in RESOURCE_REPOSITORIES: raise HTTPException(status_code=404, detail="Resource not found")
+
+    def add_item(items):
+        new_item = data
+        new_item['id'] = get_next_id(items)
+        new_item['order'] = get_next_order(items)
+        items.append(new_item)
+        return dict(new_item)
+
+    new_item = await asyncio.to_thread(RESOURCE_REPOSITORIES[resource].update, add_item)
     trigger_build(background_tasks)
     return new_item
 
 @app.get("/{resource}/{item_id}", response_model=Dict)
 async def get_resource_item(resource: str, item_id: int):
-    if resource not in RESOURCE_PATHS: raise HTTPException(status_code=404, detail="Resource not found")
-    items = load_data(RESOURCE_PATHS[resource])
-    item = next((p for p in items if p.get('id') == item_id), None)
+    if resource not in RESOURCE_REPOSITORIES: raise HTTPException(status_code=404, detail="Resource not found")
+    item = RESOURCE_REPOSITORIES[resource].snapshot().by_id.get(item_id)
     if not item: raise HTTPException(status_code=404, detail="Item not found")
-    return item
+    image_index.refresh()
+    return resource_record(item)
 
 @app.put("/{resource}/{item_id}", response_model=Dict)
 async def update_resource_item(resource: str, item_id: int, data: Dict, background_tasks: BackgroundTasks):
-    if resource not in RESOURCE_PATHS: raise HTTPException(status_code=404, detail="Resource not found")
-    items = load_data(RESOURCE_PATHS[resource])
-    item_index = next((i for i, p in enumerate(items) if p.get('id') == item_id), -1)
-    if item_index == -1: raise HTTPException(status_code=404, detail="Item not found")
-    items[item_index].update(data)
-    items[item_index]['id'] = item_id # Ensure ID is not changed
-    save_data(RESOURCE_PATHS[resource], items)
+    if resource not in RESOURCE_REPOSITORIES: raise HTTPException(status_code=404, detail="Resource not found")
+
+    def apply_update(items):
+        item = next((p for p in items if p.get('id') == item_id), None)
+        if not item: raise HTTPException(status_code=404, detail="Item not found")
+        item.update(data)
+        item['id'] = item_id # Ensure ID is not changed
+        return dict(item)
+
+    item = await asyncio.to_thread(RESOURCE_REPOSITORIES[resource].update, apply_update)
     trigger_build(background_tasks)
-    return items[item_index]
+    return item
 
 @app.delete("/{resource}/{item_id}", status_code=204)
 async def delete_resource_item(resource: str, item_id: int, background_tasks: BackgroundTasks):
-    if resource not in RESOURCE_PATHS: raise HTTPException(status_code=404, detail="Resource not found")
-    items = load_data(RESOURCE_PATHS[resource])
-    if not any(p.get('id') == item_id for p in items): raise HTTPException(status_code=404, detail="Item not found")
-    save_data(RESOURCE_PATHS[resource], [p for p in items if p.get('id') != item_id])
+    if resource not in RESOURCE_REPOSITORIES: raise HTTPException(status_code=404, detail="Resource not found")
+
+    def remove_item(items):
+        if not any(p.get('id') == item_id for p in items): raise HTTPException(status_code=404, detail="Item not found")
+        items[:] = [p for p in items if p.get('id') != item_id]
+
+    await asyncio.to_thread(RESOURCE_REPOSITORIES[resource].update, remove_item)
     trigger_build(background_tasks)
     return Response(status_code=204)
 
+# --- Image Garbage Collection ---
+@app.post("/images/gc", summary="Remove unreferenced and duplicate images")
+async def collect_images(dry_run: bool = False, min_age: float = Query(image_gc.DEFAULT_MIN_AGE, ge=0)):
+    """
+    Removes images that no record, template or page references (e.g. images replaced or left
+    behind by deleted projects and exhibitions, or old copies like images/galerie_backup),
+    hard-links byte-identical images to one copy and removes unused derivatives; see image_gc.py.
+    Files modified within `min_age` seconds are kept. With `dry_run`, only reports what would
+    be done. Returns the affected paths and `reclaimed_bytes`.
+    """
+    return await asyncio.to_thread(image_gc.collect, dry_run, min_age)
+
 # --- Upload & Static File Serving ---
 @app.post("/upload/{resource_type}", summary="Upload an image")
-async def upload_image_for_resource(resource_type: str, image: UploadFile = File(...)):
+async def upload_image_for_resource(resource_type: str, background_tasks: BackgroundTasks, image: UploadFile = File(...)):
+    # Keep uploads inside their own folder of IMAGES_DIR (no "..", no hidden or internal folders).
+    if not re.fullmatch(r"[^\W_][\w-]*", resource_type): raise HTTPException(status_code=404, detail="Resource not found")
     upload_dir = IMAGES_DIR / resource_type
-    upload_dir.mkdir(parents=True, exist_ok=True)
     sanitized_filename = Path(sanitize_filename(image.filename)).name
     file_location = upload_dir / sanitized_filename
     if file_location.exists():
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         sanitized_filename = f"{Path(sanitized_filename).stem}_{timestamp}{Path(sanitized_filename).suffix}"
         file_location = upload_dir / sanitized_filename
-    with open(file_location, "wb+") as file_object: shutil.copyfileobj(image.file, file_object)
-    relative_path = os.path.join("images", resource_type, sanitized_filename)
+    stored = await store_upload(image, file_location)
+    if not stored.duplicate: background_tasks.add_task(index_images, stored.path)
+    relative_path = os.path.join("images", resource_type, stored.path.name)
     return {"path": relative_path.replace("\\", "/")}
 
 app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
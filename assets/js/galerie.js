@@ -0,0 +1,115 @@
+/*
+	Infinite scroll for the paginated galerie (see build.py).
+	When the pagination comes into view, the next page's JSON manifest is fetched and its
+	images are appended to the grid. Without JavaScript the pagination links keep working.
+*/
+(function() {
+
+	var grid = document.getElementById('nanogallery2'),
+		pagination = document.querySelector('.pagination[data-next-manifest]');
+
+	if (!grid || !pagination || !pagination.getAttribute('data-next-manifest')
+	||	!('IntersectionObserver' in window) || !window.fetch)
+		return;
+
+	var loading = false;
+
+	function createImage(image) {
+
+		var img = document.createElement('img');
+
+		img.src = image.src;
+		img.alt = '';
+		img.loading = 'lazy';
+		img.decoding = 'async';
+		img.setAttribute('data-ngsrc', image.src);
+
+		if (image.width && image.height) {
+			img.width = image.width;
+			img.height = image.height;
+		}
+
+		if (image.color)
+			img.style.backgroundColor = image.color;
+
+		if (!image.srcset)
+			return img;
+
+		// Same markup as the picture macro in src/_responsive.html.
+		var picture = document.createElement('picture');
+
+		Object.keys(image.srcset).forEach(function(format) {
+
+			var source = document.createElement('source');
+
+			source.type = 'image/' + format;
+			source.srcset = image.srcset[format];
+			source.sizes = '(max-width: 736px) 100vw, 30vw';
+			picture.appendChild(source);
+
+		});
+
+		picture.appendChild(img);
+
+		return picture;
+
+	}
+
+	function appendImage(image) {
+
+		var column = document.createElement('div'),
+			span = document.createElement('span');
+
+		column.className = 'col-4';
+		span.className = 'image fit';
+		span.appendChild(createImage(image));
+		column.appendChild(span);
+		grid.appendChild(column);
+
+	}
+
+	var observer = new IntersectionObserver(function(entries) {
+
+		var url = pagination.getAttribute('data-next-manifest');
+
+		if (loading || !url || !entries.some(function(entry) { return entry.isIntersecting; }))
+			return;
+
+		loading = true;
+
+		fetch(url)
+			.then(function(response) {
+				if (!response.ok)
+					throw new Error(response.status);
+				return response.json();
+			})
+			.then(function(page) {
+
+				page.images.forEach(appendImage);
+
+				if (page.next) {
+					pagination.setAttribute('data-next-manifest', page.next);
+					// Observing again reports the current state, in case the pagination is still in view.
+					observer.unobserve(pagination);
+					observer.observe(pagination);
+				}
+				else {
+					// Everything is shown, so the page links are no longer needed.
+					pagination.parentNode.removeChild(pagination);
+					observer.disconnect();
+				}
+
+			})
+			.catch(function() {
+				// Fall back to the pagination links.
+				observer.disconnect();
+			})
+			.then(function() {
+				loading = false;
+			});
+
+	}, { rootMargin: '600px 0px' });
+
+	observer.observe(pagination);
+
+})();
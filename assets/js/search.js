@@ -0,0 +1,107 @@
+/*
+	Client-side search over search-index.json (see search_index.py), for the static site.
+	Matches the API's GET /search: case and diacritics are ignored the same way, every
+	word of the query must match, and words also match longer tokens they are a prefix of.
+
+		Search.load('search-index.json').then(function(search) {
+			search.query('dobrany'); // [{ resource, id, title, image, score }, ...]
+		});
+
+	Used by obrazy.html to filter the paintings.
+*/
+var Search = (function() {
+
+	// Same as fold() in search_index.py for the site's (Latin) text: casefold, decompose (NFKD)
+	// and strip every mark. 'ß' is the one letter whose casefold differs from toLowerCase.
+	function fold(text) {
+		return String(text).toLowerCase().replace(/\u00df/g, 'ss').normalize('NFKD').replace(/\p{M}/gu, '');
+	}
+
+	function tokenize(text) {
+		return fold(text).match(/[\p{L}\p{N}_]+/gu) || [];
+	}
+
+	// First position in the sorted terms not less than value.
+	function lowerBound(terms, value) {
+
+		var low = 0, high = terms.length;
+
+		while (low < high) {
+			var middle = (low + high) >> 1;
+			if (terms[middle] < value) low = middle + 1;
+			else high = middle;
+		}
+
+		return low;
+
+	}
+
+	function create(index) {
+
+		var terms = Object.keys(index.terms).sort();
+
+		function query(text, resource, limit) {
+
+			var words = tokenize(text).filter(function(word, i, words) { return words.indexOf(word) == i; }),
+				scores = null;
+
+			if (!words.length)
+				return [];
+
+			words.forEach(function(word) {
+
+				var matches = {};
+
+				for (var i = lowerBound(terms, word); i < terms.length && terms[i].indexOf(word) === 0; i++) {
+
+					var bonus = terms[i] === word ? index.exact_bonus : 1,
+						postings = index.terms[terms[i]];
+
+					for (var j = 0; j < postings.length; j += 2) {
+						var doc = postings[j], score = postings[j + 1] * bonus;
+						if ((!resource || index.docs[doc][0] === resource) && !(matches[doc] >= score))
+							matches[doc] = score;
+					}
+
+				}
+
+				if (scores === null)
+					scores = matches;
+				else
+					Object.keys(scores).forEach(function(doc) {
+						if (doc in matches) scores[doc] += matches[doc];
+						else delete scores[doc];
+					});
+
+			});
+
+			return Object.keys(scores)
+				.map(function(doc) {
+					var entry = index.docs[doc];
+					return { resource: entry[0], id: entry[1], title: entry[2], image: entry[3], score: scores[doc] };
+				})
+				.sort(function(a, b) {
+					return b.score - a.score || fold(a.title).localeCompare(fold(b.title));
+				})
+				.slice(0, limit || 20);
+
+		}
+
+		return { query: query };
+
+	}
+
+	return {
+		fold: fold,
+		load: function(url) {
+			return fetch(url)
+				.then(function(response) {
+					if (!response.ok)
+						throw new Error(response.status);
+					return response.json();
+				})
+				.then(create);
+		}
+	};
+
+})();
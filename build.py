@@ -1,9 +1,25 @@
 #! python3
 import os
+import re
+import sys
 import time
 import json
-from jinja2 import Environment, FileSystemLoader
+import uuid
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateNotFound, meta
 from pathlib import Path
+from typing import Optional
+
+import derivatives
+import image_metadata
+import search_index
+import static_output
+from storage import FileLock, Snapshot, StorageError, get_repository
 
 # --- Configuration ---
 BASE_DIR = Path(__file__).resolve().parent
@@ -12,31 +28,71 @@ OUTPUT_DIR = BASE_DIR
 TEMPLATES_DIR = SRC_DIR
 DATA_DIR = SRC_DIR / "data"
 IMAGES_DIR = BASE_DIR / "images"  # General images directory
+MANIFEST_PATH = BASE_DIR / ".build-manifest.json"
+# Structured stats of the last build, for the API's /metrics when builds run as a subprocess.
+BUILD_STATS_PATH = BASE_DIR / ".build-stats.json"
+# Held while a build runs, so builds never overlap, whether they are run by API workers or by hand.
+BUILD_LOCK_PATH = BASE_DIR / ".build.lock"
+BYTECODE_CACHE_DIR = BASE_DIR / ".jinja-cache"
+# Fingerprint the assets referenced from container.html, precompress the output and write
+# the nginx cache include. Enabled for the nginx deployment (see Dockerfile) or with
+# --optimize; off by default so the committed HTML keeps plain asset URLs.
+OPTIMIZE_STATIC = os.environ.get("BUILD_OPTIMIZE_STATIC", "0") == "1"
+# Generate responsive derivatives and point srcsets at them. They live in images/_derivatives/,
+# which is not committed, so this is only enabled where they are served too (see Dockerfile)
+# or with --responsive; off by default so the committed HTML never references them.
+RESPONSIVE_IMAGES = os.environ.get("BUILD_RESPONSIVE_IMAGES", "0") == "1"
+# Galerie images per page: galerie.html shows the first page, galerie-<n>.html the others,
+# and galerie/<n>.json lists each page's images for infinite scroll.
+GALERIE_PAGE_SIZE = int(os.environ.get("GALERIE_PAGE_SIZE", "24"))
+# Processes rendering pages concurrently (or --workers). Each worker starts a Python process
+# and receives the loaded data once, which only pays off for large catalogues; with 1, pages
+# are rendered one after another in the build's own process.
+RENDER_WORKERS = int(os.environ.get("BUILD_RENDER_WORKERS", "1"))
+# Rendered previews kept in memory (see SiteBuilder.preview); least recently used are dropped.
+PREVIEW_CACHE_SIZE = 32
+# Read-only JSON snapshots of the data, served by nginx (see render_data_snapshots).
+SNAPSHOT_DIR = "data"
+# Bump when the layout of the snapshots changes.
+SNAPSHOT_FORMAT = 1
 
-# --- Setup Jinja2 Environment ---
-env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+# --- Build Inputs ---
+# Template variables that are backed by data, mapped to the input they are built from.
+# Input keys are "<kind>:<path>" where kind is template, data (the records of a data file
+# relative to DATA_DIR, in whichever storage backend is configured), or dir and file
+# (both relative to BASE_DIR).
+DATA_SOURCES = {
+    'paintings': "data:paintings.json",
+    'projekty': "data:projekty.json",
+    'vystavy': "data:vystavy.json",
+    'images': "dir:images/galerie",
+    'galerie': "dir:images/galerie",
+    'responsive': f"file:{derivatives.INDEX_PATH.relative_to(BASE_DIR).as_posix()}",
+    'image_metadata': f"file:{image_metadata.INDEX_PATH.relative_to(BASE_DIR).as_posix()}",
+}
+# Variables that are split into pages; a template using one is rendered once per page (see paginate).
+PAGINATED_SOURCES = {
+    'galerie': GALERIE_PAGE_SIZE,
+}
 
 
-# --- Helper Function to load and sort JSON data ---
+# --- Helper Function to load and sort data ---
 def load_and_sort_data(filename: Path):
-    """Loads JSON data from a file and sorts it by the 'order' field."""
-    if not filename.is_file():
-        print(f"Warning: Data file not found: {filename}")
-        return []
+    """
+    Loads the records of a data file through its repository (see storage.py), so either
+    storage backend can be built from, and sorts them by the 'order' field.
+    """
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if not isinstance(data, list):
-            print(f"Warning: JSON data in {filename} is not a list.")
-            return []
-        # Sort the data based on the 'order' key, from low to high.
-        return sorted(data, key=lambda x: x.get('order', float('inf')), reverse=True)
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from file: {filename}")
-        return []
-    except Exception as e:
-        print(f"Error loading data from {filename}: {e}")
+        data = get_repository(filename).load()
+    except StorageError as e:
+        print(f"Error loading data: {e}")
         return []
+    return sort_records(data)
+
+
+def sort_records(data):
+    # Sort the data based on the 'order' key, from high to low.
+    return sorted(data, key=lambda x: x.get('order', float('inf')), reverse=True)
 
 
 # --- Helper Function for Sorting Galerie Images ---
@@ -53,71 +109,746 @@ def get_galerie_sort_key(filename):
         return float('inf')
 
 
-# --- Main Build Logic ---
-if __name__ == "__main__":
-    print("Starting build process...")
-    start_time = time.time()
-
-    OUTPUT_DIR.mkdir(exist_ok=True)
-
-    # --- Load All Data from JSON ---
-    paintings_data = load_and_sort_data(DATA_DIR / "paintings.json")
-    projekty_data = load_and_sort_data(DATA_DIR / "projekty.json")
-    vystavy_data = load_and_sort_data(DATA_DIR / "vystavy.json")
-
-    # --- Process Paintings Data ---
-    # Add the full relative URL to each painting record for use in the template.
-    for painting in paintings_data:
+# --- Data Loaders ---
+def add_painting_urls(paintings):
+    """Adds the full relative URL to each painting record for use in the template."""
+    for painting in paintings:
         if 'filename' in painting:
             painting['url'] = f"{IMAGES_DIR.name}/obrazy/{painting['filename']}"
+    return paintings
+
+
+def load_paintings():
+    paintings_data = add_painting_urls(load_and_sort_data(DATA_DIR / "paintings.json"))
     print(f"Loaded and processed {len(paintings_data)} paintings.")
+    return paintings_data
+
+
+def load_projekty():
+    projekty_data = load_and_sort_data(DATA_DIR / "projekty.json")
     print(f"Loaded {len(projekty_data)} projects.")
+    return projekty_data
+
+
+def load_vystavy():
+    vystavy_data = load_and_sort_data(DATA_DIR / "vystavy.json")
     print(f"Loaded {len(vystavy_data)} exhibitions.")
+    return vystavy_data
 
-    # --- Get Galerie Image List (unchanged logic) ---
-    galerie_images = []
+
+def load_galerie_images():
     galerie_dir = IMAGES_DIR / "galerie"
-    if galerie_dir.is_dir():
-        galerie_files = [f for f in os.listdir(galerie_dir) if (galerie_dir / f).is_file()]
-        galerie_files.sort(key=get_galerie_sort_key, reverse=True)
-        galerie_images = [f"images/galerie/{name}" for name in galerie_files]
-        print(f"Found {len(galerie_images)} galerie images.")
-    else:
+    if not galerie_dir.is_dir():
         print(f"Warning: Galerie directory not found: {galerie_dir}")
+        return []
+    galerie_files = [f for f in os.listdir(galerie_dir) if (galerie_dir / f).is_file()]
+    galerie_files.sort(key=get_galerie_sort_key, reverse=True)
+    print(f"Found {len(galerie_files)} galerie images.")
+    return [f"images/galerie/{name}" for name in galerie_files]
 
-    # --- Render Templates ---
-    if not TEMPLATES_DIR.is_dir():
-        print(f"Error: Templates directory not found: {TEMPLATES_DIR}")
-        exit(1)
 
-    print(f"Rendering templates from '{TEMPLATES_DIR}' to '{OUTPUT_DIR}'...")
-    rendered_files = 0
-    for filename in os.listdir(TEMPLATES_DIR):
-        if filename.endswith(".html"):
-            template_path = TEMPLATES_DIR / filename
-            output_path = OUTPUT_DIR / filename
+def load_galerie():
+    """Loads the galerie images with their intrinsic dimensions, in the order of load_galerie_images."""
+    index = image_metadata.load_index()
+    galerie = []
+    for url in load_galerie_images():
+        info = image_metadata.public_fields(index.get(url)) or {}
+        galerie.append({'url': url, 'width': info.get('width'), 'height': info.get('height'), 'color': info.get('color')})
+    return galerie
+
+
+def load_responsive_images():
+    """Loads srcset data for every image with generated derivatives, keyed by image URL."""
+    return derivatives.responsive_images(derivatives.load_index())
+
+
+def load_image_metadata():
+    """Loads dimensions, format and dominant colour of every readable image, keyed by image URL."""
+    index = image_metadata.load_index()
+    return {url: info for url, info in ((url, image_metadata.public_fields(entry)) for url, entry in index.items()) if info}
+
+
+# How records that were not loaded from their data file (see SiteBuilder.preview) become
+# template data, as the loaders above do for the stored ones.
+RECORD_PREPARERS = {
+    'paintings': lambda records: add_painting_urls(sort_records(records)),
+    'projekty': sort_records,
+    'vystavy': sort_records,
+}
+
+DATA_LOADERS = {
+    'paintings': load_paintings,
+    'projekty': load_projekty,
+    'vystavy': load_vystavy,
+    'images': load_galerie_images,
+    'galerie': load_galerie,
+    'responsive': load_responsive_images,
+    'image_metadata': load_image_metadata,
+}
+
+
+def render_search_index(paintings, projekty, vystavy):
+    """The static search index (see search_index.py), for searching the site without the API."""
+    index = search_index.SearchIndex()
+    for resource, records in (('paintings', paintings), ('projekty', projekty), ('vystavy', vystavy)):
+        index.update(resource, records)
+    return {'search-index.json': index.to_static()}
+
+
+def snapshot_json(content) -> bytes:
+    # Same encoding as the API's responses.
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def render_data_snapshots(paintings, projekty, vystavy, metadata):
+    """
+    Read-only copies of the records as GET /<resource> and GET /<resource>/<id> return them
+    (sorted by 'order', painting URLs resolved, with 'image_info'), for nginx to serve:
+    data/<resource>.json, a copy of it under a content-hashed name that never changes,
+    data/<resource>/<id>.json per record, and data/manifest.json with the content hashes.
+    The manifest comes last, so it only ever points at files that were already written.
+    """
+    outputs = {}
+    manifest = {'format': SNAPSHOT_FORMAT, 'resources': {}}
+    for resource, records in (('paintings', paintings), ('projekty', projekty), ('vystavy', vystavy)):
+        exported = []
+        items = {}
+        # Ordered like the API (ascending 'order', then 'id'); the templates list them the other way round.
+        for record in Snapshot.from_items(records, "", 0).ordered:
+            if resource == 'paintings':
+                record = {**record, 'url': f"/{IMAGES_DIR.name}/obrazy/{record.get('filename', '')}"}
+            url = record.get('url') if resource == 'paintings' else record.get('image')
+            record = {**record, 'image_info': metadata.get((url or "").lstrip("/"))}
+            exported.append(record)
+            content = snapshot_json(record)
+            outputs[f"{SNAPSHOT_DIR}/{resource}/{record.get('id')}.json"] = content
+            items[str(record.get('id'))] = hash_bytes(content)
+        content = snapshot_json(exported)
+        versioned = static_output.fingerprinted_name(Path(f"{resource}.json"), content)
+        outputs[f"{SNAPSHOT_DIR}/{resource}.json"] = content
+        outputs[f"{SNAPSHOT_DIR}/{versioned}"] = content
+        manifest['resources'][resource] = {
+            'url': f"/{SNAPSHOT_DIR}/{versioned}",
+            'sha256': hash_bytes(content),
+            'count': len(exported),
+            'item_url': f"/{SNAPSHOT_DIR}/{resource}/{{id}}.json",
+            'items': items,
+        }
+    outputs[f"{SNAPSHOT_DIR}/manifest.json"] = snapshot_json(manifest)
+    return outputs
+
+
+# Files generated from data alone, without a template: manifest key -> (data variables passed
+# to the render function in this order, render function, further inputs). The render
+# function returns {output path relative to OUTPUT_DIR: content}, like a page template.
+DATA_OUTPUTS = {
+    'search-index.json': (('paintings', 'projekty', 'vystavy'), render_search_index, ("file:search_index.py",)),
+    f'{SNAPSHOT_DIR}/': (('paintings', 'projekty', 'vystavy', 'image_metadata'), render_data_snapshots, ()),
+}
+
+
+def preview_template(page: str):
+    """Returns the page template that renders an output page, or None if there is none."""
+    match = re.fullmatch(r"(.+)-\d+\.html|(.+)/\d+\.json", page)
+    filename = page if not match else f"{match.group(1) or match.group(2)}.html"
+    if not filename.endswith(".html") or filename.startswith("_") or "/" in filename:
+        return None
+    return filename if (TEMPLATES_DIR / filename).is_file() else None
+
+
+def paginate(filename: str, items, page_size: int):
+    """
+    Splits items into the pages of one template. The first page keeps the template's name,
+    page n is written as <stem>-<n>.html and its manifest as <stem>/<n>.json.
+    Returns one dict per page, which templates receive in place of the item list.
+    """
+    stem = Path(filename).stem
+    count = max(1, -(-len(items) // page_size))
+
+    def page_url(n):
+        return filename if n == 1 else f"{stem}-{n}.html"
+
+    def manifest_url(n):
+        return f"{stem}/{n}.json"
+
+    return [
+        {
+            'number': n,
+            'pages': count,
+            'entries': items[(n - 1) * page_size:n * page_size],
+            'url': page_url(n),
+            'page_urls': [page_url(i) for i in range(1, count + 1)],
+            'previous_url': page_url(n - 1) if n > 1 else None,
+            'next_url': page_url(n + 1) if n < count else None,
+            'manifest_url': manifest_url(n),
+            'next_manifest_url': manifest_url(n + 1) if n < count else None,
+        }
+        for n in range(1, count + 1)
+    ]
+
+
+def render_page_manifest(page, responsive) -> bytes:
+    """Compact JSON listing a page's images (with srcsets where derivatives exist) for infinite scroll."""
+    images = []
+    for item in page['entries']:
+        image = {'src': item['url'], 'width': item.get('width'), 'height': item.get('height')}
+        if item.get('color'):
+            image['color'] = item['color']
+        derived = responsive.get(item['url'])
+        if derived:
+            image['srcset'] = derived['srcset']
+        images.append(image)
+    manifest = {'page': page['number'], 'pages': page['pages'], 'next': page['next_manifest_url'], 'images': images}
+    return json.dumps(manifest, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# --- Hashing Helpers ---
+def hash_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path: Path):
+    """Returns the content hash of a file, or None if it does not exist."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def hash_directory(path: Path):
+    """
+    Returns a hash of a directory listing (names and sizes of its files).
+    Pages only reference files by name, so the image contents themselves are not read.
+    """
+    if not path.is_dir():
+        return None
+    entries = sorted(
+        f"{entry.name}:{entry.stat().st_size}" for entry in os.scandir(path) if entry.is_file()
+    )
+    return hash_bytes("\n".join(entries).encode('utf-8'))
+
+
+def hash_input(key: str):
+    kind, _, name = key.partition(":")
+    if kind == "template":
+        return hash_file(TEMPLATES_DIR / name)
+    if kind == "data":
+        # The repository's data version: the file's content hash, or a version counter in SQLite.
+        try:
+            return get_repository(DATA_DIR / name).snapshot().version
+        except StorageError:
+            return None
+    if kind == "dir":
+        return hash_directory(BASE_DIR / name)
+    if kind == "file":
+        return hash_file(BASE_DIR / name)
+    raise ValueError(f"Unknown build input: {key}")
+
+
+# The build script itself is an input of every page: a change to it invalidates the manifest.
+BUILD_VERSION = hash_file(Path(__file__))
+
+
+# --- Build Manifest ---
+def load_manifest():
+    if not MANIFEST_PATH.is_file():
+        return {}
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def load_build_stats():
+    """Returns the stats the last build wrote (see SiteBuilder.build), or None."""
+    try:
+        with open(BUILD_STATS_PATH, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        return stats if isinstance(stats, dict) else None
+    except (json.JSONDecodeError, IOError):
+        return None
+
+
+def save_build_stats(stats):
+    tmp_path = BUILD_STATS_PATH.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, BUILD_STATS_PATH)
+
+
+def is_up_to_date(record, current_hash) -> bool:
+    """A page is up to date if none of its recorded inputs changed and all of its outputs are intact."""
+    if not record or not record.get('inputs') or not record.get('outputs'):
+        return False
+    if any(current_hash(key) != digest for key, digest in record['inputs'].items()):
+        return False
+    return all(hash_file(OUTPUT_DIR / name) == digest for name, digest in record['outputs'].items())
+
+
+# --- Build Engine ---
+class SiteBuilder:
+    """
+    Long-lived build engine. It keeps one Jinja environment, so templates stay compiled
+    between builds and compiled bytecode survives restarts in BYTECODE_CACHE_DIR.
+    Edited templates are still picked up, as the environment checks their mtimes.
+    """
+
+    PHASES = ("derive", "assets", "load", "scan", "render")
+
+    def __init__(self, optimize_static: bool = OPTIMIZE_STATIC, render_workers: int = RENDER_WORKERS,
+                 responsive_images: bool = RESPONSIVE_IMAGES):
+        self.optimize_static = optimize_static
+        self.responsive_images = responsive_images
+        self.render_workers = render_workers
+        BYTECODE_CACHE_DIR.mkdir(exist_ok=True)
+        self.env = Environment(
+            loader=FileSystemLoader(TEMPLATES_DIR),
+            bytecode_cache=FileSystemBytecodeCache(str(BYTECODE_CACHE_DIR)),
+        )
+        self._lock = BUILD_LOCK
+        self._timings = {}
+        # Preview state: dependencies per template, loaded data per variable and rendered
+        # outputs, each stored with the input hashes it was computed from.
+        self._preview_lock = threading.Lock()
+        self._preview_dependencies = {}
+        self._preview_data = {}
+        self._previews = OrderedDict()
+
+    @contextmanager
+    def _timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._timings[phase] += time.perf_counter() - start
+
+    def _load_data(self, variable):
+        # Without responsive images, pages get no srcsets, even if derivatives exist.
+        if variable == 'responsive' and not self.responsive_images:
+            return {}
+        return DATA_LOADERS[variable]()
+
+    def find_template_dependencies(self, template_name: str):
+        """
+        Returns the inputs a page depends on: every template it pulls in through
+        extends/include/import, plus the data sources behind the variables it uses.
+        """
+        templates, variables = set(), set()
+        pending = [template_name]
+        while pending:
+            name = pending.pop()
+            if name in templates:
+                continue
+            templates.add(name)
+            source, _, _ = self.env.loader.get_source(self.env, name)
+            ast = self.env.parse(source)
+            variables |= meta.find_undeclared_variables(ast)
+            # Dynamic references (e.g. {% include some_var %}) are reported as None.
+            pending.extend(ref for ref in meta.find_referenced_templates(ast) if ref)
+        data_variables = sorted(v for v in variables if v in DATA_SOURCES)
+        inputs = [f"template:{name}" for name in sorted(templates)]
+        inputs += [DATA_SOURCES[v] for v in data_variables]
+        return inputs, data_variables
+
+    def build(self, force: bool = False, requested_at: Optional[float] = None):
+        """
+        Renders every template in TEMPLATES_DIR whose inputs changed since the last build.
+        Pass force=True to ignore the manifest and re-render all pages.
+        Pass requested_at (a time.time() value) to skip the build, returning None, if a build
+        that started after it has already finished successfully (e.g. in another API worker).
+        Returns a summary dict with the names of rendered, unchanged, skipped and failed pages,
+        the time spent in each phase (derive, assets, load, scan, render) and rendering each
+        page in seconds, and the build's id, status ("ok" or "failed"), start, end and duration.
+        The same stats are written to BUILD_STATS_PATH (with status "error" if the build raised);
+        while the build runs, the file holds its id and start with status "running".
+        Concurrent calls are serialized, across processes too (see BUILD_LOCK_PATH).
+        """
+        with self._lock:
+            last = load_build_stats() if requested_at is not None else None
+            if last and last.get('status') == 'ok' and last.get('started_at', 0) > requested_at:
+                print("Skipping build: a build started since it was requested.")
+                return None
+            stats = {'id': uuid.uuid4().hex, 'started_at': time.time()}
+            save_build_stats({**stats, 'status': 'running'})
+
+            def finish(**fields):
+                stats.update(fields, finished_at=time.time())
+                stats['duration'] = stats['finished_at'] - stats['started_at']
+                save_build_stats(stats)
+                return stats
+
             try:
-                template = env.get_template(filename)
-
-                # Base context available to all templates
-                context = {
-                    'projekty': projekty_data,
-                    'vystavy': vystavy_data,
-                }
-
-                # Add specific context keys that individual pages expect
-                if filename == "obrazy.html":
-                    context['paintings'] = paintings_data
-                elif filename == "galerie.html":
-                    context['images'] = galerie_images
-
-                html_content = template.render(context)
-                with open(output_path, "w", encoding="utf-8") as f:
-                    f.write(html_content)
-                rendered_files += 1
-                print(f"  - Rendered {filename}")
+                summary = self._build(force)
             except Exception as e:
+                finish(status='error', error=str(e), timings=dict(self._timings))
+                raise
+            return finish(**summary, status='failed' if summary['failed'] else 'ok')
+
+    def _build(self, force):
+        print("Starting build process...")
+        start_time = time.time()
+        self._timings = dict.fromkeys(self.PHASES, 0.0)
+        template_timings = {}
+
+        if not TEMPLATES_DIR.is_dir():
+            raise FileNotFoundError(f"Templates directory not found: {TEMPLATES_DIR}")
+        OUTPUT_DIR.mkdir(exist_ok=True)
+
+        # The image metadata index and responsive image derivatives are only computed for
+        # new or changed sources. The derivative cache is warmed at deploy time (see
+        # entrypoint.sh), so a build only processes images uploaded since.
+        with self._timed("derive"):
+            try:
+                image_metadata.update_index()
+            except Exception as e:
+                print(f"Error updating the image metadata index: {e}")
+            if self.responsive_images:
+                try:
+                    derivatives.update_derivatives()
+                except Exception as e:
+                    print(f"Error generating image derivatives: {e}")
+
+        manifest = load_manifest()
+        with self._timed("assets"):
+            assets = self._fingerprint_assets(manifest.get('assets'))
+
+        # Every page embeds the asset URLs, so a changed asset (or page size) invalidates all of them.
+        version = hash_bytes(json.dumps([BUILD_VERSION, self.optimize_static, self.responsive_images, assets, PAGINATED_SOURCES], sort_keys=True).encode('utf-8'))
+        previous_pages = manifest.get('pages', {})
+        if force or manifest.get('version') != version:
+            previous_pages = {}
+
+        # Per-build memos, so each input is hashed and each data source loaded at most once.
+        hashes = {}
+        loaded = {}
+
+        def current_hash(key):
+            if key not in hashes:
+                with self._timed("scan"):
+                    hashes[key] = hash_input(key)
+            return hashes[key]
+
+        def get_data(variable):
+            if variable not in loaded:
+                # Directory listings are scanned, JSON data files are loaded.
+                phase = "scan" if DATA_SOURCES[variable].startswith("dir:") else "load"
+                with self._timed(phase):
+                    loaded[variable] = self._load_data(variable)
+            return loaded[variable]
+
+        print(f"Rendering templates from '{TEMPLATES_DIR}' to '{OUTPUT_DIR}'...")
+        pages = {}
+        summary = {'rendered': [], 'unchanged': [], 'skipped': [], 'failed': []}
+        pending = []
+        for filename in sorted(os.listdir(TEMPLATES_DIR)):
+            # Templates starting with an underscore are partials (e.g. macros), not pages.
+            if not filename.endswith(".html") or filename.startswith("_"):
+                continue
+            record = previous_pages.get(filename)
+            if is_up_to_date(record, current_hash):
+                pages[filename] = record
+                summary['skipped'].append(filename)
+                for name in record['outputs']:
+                    self._finish_output(OUTPUT_DIR / name)
+                continue
+            try:
+                inputs, data_variables = self.find_template_dependencies(filename)
+                # Only the data sources the page actually references are loaded.
+                for variable in data_variables:
+                    get_data(variable)
+                pending.append((filename, inputs, data_variables))
+            except Exception as e:
+                summary['failed'].append(filename)
                 print(f"Error rendering template {filename}: {e}")
 
-    end_time = time.time()
-    print(f"\nBuild process finished in {end_time - start_time:.2f} seconds. Rendered {rendered_files} files.")
+        with self._timed("render"):
+            results = self._render_pages([(filename, data_variables) for filename, _, data_variables in pending], loaded, assets)
+        for filename, inputs, _ in pending:
+            outputs, page_summary, seconds, error = results[filename]
+            if error:
+                summary['failed'].append(filename)
+                print(f"Error rendering template {filename}: {error}")
+                continue
+            summary['rendered'] += page_summary['rendered']
+            summary['unchanged'] += page_summary['unchanged']
+            # Pages that no longer exist (e.g. the galerie got shorter) are removed.
+            previous_outputs = (manifest.get('pages', {}).get(filename) or {}).get('outputs', {})
+            for name in previous_outputs.keys() - outputs.keys():
+                static_output.remove_with_siblings(OUTPUT_DIR / name)
+            template_timings[filename] = seconds
+            pages[filename] = {
+                'inputs': {key: current_hash(key) for key in inputs},
+                'outputs': outputs,
+            }
+
+        for name, (variables, render, extra_inputs) in DATA_OUTPUTS.items():
+            record = previous_pages.get(name)
+            if is_up_to_date(record, current_hash):
+                pages[name] = record
+                summary['skipped'].append(name)
+                for output in record['outputs']:
+                    self._finish_output(OUTPUT_DIR / output)
+                continue
+            try:
+                data = [get_data(variable) for variable in variables]
+                render_start = time.perf_counter()
+                with self._timed("render"):
+                    outputs = self._write_outputs(render(*data), summary)
+                previous_outputs = (manifest.get('pages', {}).get(name) or {}).get('outputs', {})
+                for output in previous_outputs.keys() - outputs.keys():
+                    static_output.remove_with_siblings(OUTPUT_DIR / output)
+                template_timings[name] = time.perf_counter() - render_start
+                inputs = [DATA_SOURCES[variable] for variable in variables] + list(extra_inputs)
+                pages[name] = {'inputs': {key: current_hash(key) for key in inputs}, 'outputs': outputs}
+            except Exception as e:
+                summary['failed'].append(name)
+                print(f"Error generating {name}: {e}")
+
+        save_manifest({'version': version, 'pages': pages, 'assets': assets})
+
+        end_time = time.time()
+        summary['timings'] = dict(self._timings)
+        summary['templates'] = template_timings
+        print(
+            f"\nBuild process finished in {end_time - start_time:.2f} seconds. "
+            f"Rendered {len(summary['rendered'])} files, {len(summary['unchanged'])} unchanged, "
+            f"{len(summary['skipped'])} up to date."
+        )
+        print("Timings: " + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in summary['timings'].items()))
+        return summary
+
+    def preview(self, page: str, records=None):
+        """
+        Renders one page (e.g. "obrazy.html", "galerie-2.html" or "galerie/2.json") in memory,
+        without writing anything. `records` replaces the stored records of data variables with
+        unsaved ones, e.g. {'paintings': [...]}. Returns (content, version), where version is
+        a hash of the page's inputs, or None if no template produces the page.
+
+        Renders are cached by that version, and the data behind them by their input hash, so
+        repeated previews of unchanged templates and data only hash the inputs.
+        """
+        filename = preview_template(page)
+        if filename is None:
+            return None
+        records = records or {}
+
+        with self._preview_lock:
+            cached = self._preview_dependencies.get(filename)
+        if cached is None or any(hash_input(key) != digest for key, digest in cached[0].items()):
+            inputs, data_variables = self.find_template_dependencies(filename)
+            templates = {key: hash_input(key) for key in inputs if key.startswith("template:")}
+            cached = (templates, inputs, data_variables)
+            with self._preview_lock:
+                self._preview_dependencies[filename] = cached
+        templates, inputs, data_variables = cached
+
+        hashes = dict(templates)
+        for variable in data_variables:
+            if variable in records:
+                content = json.dumps(records[variable], sort_keys=True, default=str).encode("utf-8")
+                hashes[DATA_SOURCES[variable]] = f"unsaved:{hash_bytes(content)}"
+            else:
+                hashes[DATA_SOURCES[variable]] = hash_input(DATA_SOURCES[variable])
+        version = hash_bytes(json.dumps([BUILD_VERSION, filename, hashes], sort_keys=True).encode("utf-8"))
+
+        with self._preview_lock:
+            outputs = self._previews.get(version)
+            if outputs is not None:
+                self._previews.move_to_end(version)
+        if outputs is None:
+            context = {}
+            for variable in data_variables:
+                if variable in records:
+                    context[variable] = RECORD_PREPARERS[variable]([dict(record) for record in records[variable]])
+                    continue
+                digest = hashes[DATA_SOURCES[variable]]
+                with self._preview_lock:
+                    loaded = self._preview_data.get(variable)
+                if loaded is None or loaded[0] != digest:
+                    loaded = (digest, self._load_data(variable))
+                    with self._preview_lock:
+                        self._preview_data[variable] = loaded
+                context[variable] = loaded[1]
+            # Asset URLs are left alone: previews are shown next to the original assets.
+            outputs = {name: content if isinstance(content, bytes) else b"".join(content)
+                       for name, content in self._render_outputs(filename, context, {}).items()}
+            with self._preview_lock:
+                self._previews[version] = outputs
+                while len(self._previews) > PREVIEW_CACHE_SIZE:
+                    self._previews.popitem(last=False)
+
+        if page not in outputs:
+            return None
+        return outputs[page], version
+
+    def render_page(self, filename, context, assets):
+        """Renders and writes the outputs of one template. Returns (outputs, summary, seconds, error)."""
+        start = time.perf_counter()
+        summary = {'rendered': [], 'unchanged': []}
+        try:
+            outputs = self._write_outputs(self._render_outputs(filename, context, assets), summary)
+        except Exception as e:
+            return {}, summary, time.perf_counter() - start, str(e)
+        return outputs, summary, time.perf_counter() - start, None
+
+    def _render_pages(self, pages, data, assets):
+        """
+        Renders and writes pages, given as (template, data variables) pairs, with the loaded
+        `data`. Returns {template: (outputs, summary, seconds, error)}, where outputs maps
+        output names to content hashes. With more than one render worker, the pages are
+        rendered concurrently in a process pool, whose workers receive the data once.
+        """
+        workers = min(self.render_workers, len(pages))
+        if workers <= 1:
+            return {filename: self.render_page(filename, {v: data[v] for v in variables}, assets)
+                    for filename, variables in pages}
+        shared = {variable: data[variable] for _, variables in pages for variable in variables}
+        # Spawned workers stay safe when the build runs in a thread of the API process.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_render_worker, initargs=(self.optimize_static, shared)) as pool:
+            futures = {filename: pool.submit(_render_in_worker, filename, variables, assets) for filename, variables in pages}
+            results = {}
+            for filename, future in futures.items():
+                try:
+                    results[filename] = future.result()
+                except Exception as e:
+                    results[filename] = ({}, {}, 0.0, str(e))
+            return results
+
+    def _write_outputs(self, outputs, summary):
+        """
+        Writes outputs, given as content or an iterable of content chunks, and returns
+        {output name: content hash}. Each output is streamed into a temporary file that
+        replaces the output only if its content changed, so nginx never serves a partial file.
+        """
+        hashes = {}
+        for name, content in outputs.items():
+            output_path = OUTPUT_DIR / name
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+            digest = hashlib.sha256()
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in [content] if isinstance(content, bytes) else content:
+                        digest.update(chunk)
+                        f.write(chunk)
+                hashes[name] = digest.hexdigest()
+                if hash_file(output_path) == hashes[name]:
+                    tmp_path.unlink()
+                    summary['unchanged'].append(name)
+                else:
+                    os.replace(tmp_path, output_path)
+                    summary['rendered'].append(name)
+                    print(f"  - Rendered {name}")
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            self._finish_output(output_path)
+        return hashes
+
+    def _render_outputs(self, filename, context, assets):
+        """
+        Renders one page template. Returns {output path relative to OUTPUT_DIR: content}, with
+        one HTML file (and JSON manifest) per page if the template uses a paginated variable.
+        Pages are generators of content chunks (see Template.generate), rendered as they are
+        consumed, so a page is never held in memory as a whole.
+        """
+        template = self.env.get_template(filename)
+
+        def render(page_context):
+            # Fingerprinted references are literal text, which Jinja never splits across chunks.
+            for chunk in template.generate(page_context):
+                yield static_output.rewrite_asset_urls(chunk, assets).encode("utf-8")
+
+        paginated = [variable for variable in context if variable in PAGINATED_SOURCES]
+        if not paginated:
+            return {filename: render(context)}
+        variable = paginated[0]
+        outputs = {}
+        for page in paginate(filename, context[variable], PAGINATED_SOURCES[variable]):
+            outputs[page['url']] = render({**context, variable: page})
+            outputs[page['manifest_url']] = render_page_manifest(page, context.get('responsive') or {})
+        return outputs
+
+    def _fingerprint_assets(self, previous):
+        """Returns {asset path: fingerprinted path} for the assets container.html references."""
+        paths = []
+        if self.optimize_static:
+            try:
+                source, _, _ = self.env.loader.get_source(self.env, "container.html")
+                paths = static_output.find_asset_references(source, OUTPUT_DIR)
+            except TemplateNotFound:
+                print("Warning: container.html not found, no assets fingerprinted.")
+            static_output.write_nginx_include()
+        # With optimization off this only removes copies left over from earlier builds.
+        return static_output.fingerprint_assets(paths, OUTPUT_DIR, previous)
+
+    def _finish_output(self, output_path: Path):
+        if self.optimize_static:
+            static_output.precompress(output_path)
+        else:
+            static_output.remove_compressed(output_path)
+
+
+BUILD_LOCK = FileLock(BUILD_LOCK_PATH)
+
+
+# State of a render worker process (see SiteBuilder._render_pages).
+_worker_builder = None
+_worker_data = None
+
+
+def _init_render_worker(optimize_static, data):
+    global _worker_builder, _worker_data
+    _worker_builder = SiteBuilder(optimize_static=optimize_static, render_workers=1)
+    _worker_data = data
+
+
+def _render_in_worker(filename, data_variables, assets):
+    return _worker_builder.render_page(filename, {v: _worker_data[v] for v in data_variables}, assets)
+
+
+_default_builder = None
+_default_builder_lock = threading.Lock()
+
+
+def get_builder() -> SiteBuilder:
+    """Returns the process-wide SiteBuilder, creating it on first use."""
+    global _default_builder
+    with _default_builder_lock:
+        if _default_builder is None:
+            _default_builder = SiteBuilder()
+        return _default_builder
+
+
+def build(force: bool = False, requested_at: Optional[float] = None):
+    """Runs a build with the process-wide SiteBuilder. See SiteBuilder.build."""
+    return get_builder().build(force=force, requested_at=requested_at)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    try:
+        builder = get_builder()
+        if "--optimize" in args or "--responsive" in args:
+            builder = SiteBuilder(optimize_static="--optimize" in args or OPTIMIZE_STATIC,
+                                  responsive_images="--responsive" in args or RESPONSIVE_IMAGES)
+        if "--workers" in args:
+            builder.render_workers = int(args[args.index("--workers") + 1])
+        builder.build(force="--full" in args)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        exit(1)
@@ -0,0 +1,215 @@
+#! python3
+import os
+import io
+import json
+import base64
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps, features
+
+# --- Configuration ---
+BASE_DIR = Path(__file__).resolve().parent
+IMAGES_DIR = BASE_DIR / "images"
+# Content-addressed cache: one directory per (source content, parameters) pair.
+DERIVATIVES_DIR = IMAGES_DIR / "_derivatives"
+INDEX_PATH = DERIVATIVES_DIR / "index.json"
+SOURCE_DIRS = ("obrazy", "galerie", "projekty", "vystavy")
+SOURCE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+WIDTHS = (320, 640, 960, 1280, 1920)
+PLACEHOLDER_WIDTH = 16
+# Output formats in order of preference. AVIF is only produced when Pillow was built with it.
+FORMATS = {
+    "avif": {"quality": 55, "speed": 8},
+    "webp": {"quality": 80, "method": 4},
+}
+FORMATS = {name: options for name, options in FORMATS.items() if features.check(name)}
+
+# Any change to these parameters yields new cache keys, so stale derivatives are never reused.
+PARAMS = {"widths": WIDTHS, "formats": FORMATS, "placeholder": PLACEHOLDER_WIDTH, "version": 1}
+PARAMS_KEY = hashlib.sha256(json.dumps(PARAMS, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+# --- Helpers ---
+def hash_source(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def relative_url(path: Path) -> str:
+    return path.relative_to(BASE_DIR).as_posix()
+
+
+def load_index():
+    if not INDEX_PATH.is_file():
+        return {}
+    try:
+        with open(INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        return index if isinstance(index, dict) else {}
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+
+def save_index(index):
+    DERIVATIVES_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = INDEX_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, INDEX_PATH)
+
+
+def scan_sources():
+    """Yields (url, stat) for every source image in SOURCE_DIRS."""
+    for dir_name in SOURCE_DIRS:
+        source_dir = IMAGES_DIR / dir_name
+        if not source_dir.is_dir():
+            continue
+        for entry in os.scandir(source_dir):
+            if entry.is_file() and Path(entry.name).suffix.lower() in SOURCE_EXTENSIONS:
+                yield relative_url(Path(entry.path)), entry.stat()
+
+
+# --- Derivative Generation (runs in worker processes) ---
+def _render_derivatives(source_path: Path, target_dir: Path):
+    """Writes every width/format of one source into target_dir and returns its metadata."""
+    with Image.open(source_path) as original:
+        # Derivatives carry no EXIF, so the orientation has to be baked into the pixels.
+        image = ImageOps.exif_transpose(original)
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    width, height = image.size
+
+    variants = {name: [] for name in FORMATS}
+    for target_width in [w for w in WIDTHS if w < width] or [width]:
+        target_height = max(1, round(height * target_width / width))
+        resized = image if target_width == width else image.resize((target_width, target_height), Image.LANCZOS)
+        for name, options in FORMATS.items():
+            filename = f"{target_width}.{name}"
+            resized.save(target_dir / filename, format=name.upper(), **options)
+            variants[name].append([target_width, filename])
+
+    placeholder_height = max(1, round(height * PLACEHOLDER_WIDTH / width))
+    buffer = io.BytesIO()
+    image.convert("RGB").resize((PLACEHOLDER_WIDTH, placeholder_height), Image.BILINEAR).save(
+        buffer, format="WEBP", quality=30
+    )
+    placeholder = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {"width": width, "height": height, "variants": variants, "placeholder": placeholder}
+
+
+def process_source(source_path: str):
+    """
+    Returns the derivative record for one source image, generating the derivatives
+    only if the content-addressed cache does not already hold them.
+    """
+    path = Path(source_path)
+    source_hash = hash_source(path)
+    key = f"{source_hash[:24]}_{PARAMS_KEY}"
+    key_dir = DERIVATIVES_DIR / key
+    meta_path = key_dir / "meta.json"
+    if meta_path.is_file():
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    else:
+        # Render into a private directory and rename it into place, so a crashed or
+        # concurrent run never leaves a half-written cache entry behind.
+        tmp_dir = DERIVATIVES_DIR / f".{key}.{os.getpid()}.tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        meta = _render_derivatives(path, tmp_dir)
+        with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp_dir, key_dir)
+        except OSError:
+            # Another process produced the same key first; its output is identical.
+            for leftover in tmp_dir.iterdir():
+                leftover.unlink()
+            tmp_dir.rmdir()
+    base_url = relative_url(key_dir)
+    variants = {
+        name: [[w, f"{base_url}/{filename}"] for w, filename in entries]
+        for name, entries in meta["variants"].items()
+    }
+    return {"hash": source_hash, "key": key, **meta, "variants": variants}
+
+
+def _process_source_safe(source_path: str):
+    try:
+        return process_source(source_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+# --- Public API ---
+def update_derivatives(max_workers=None):
+    """
+    Brings the derivative index up to date with the source images. Sources whose size and
+    mtime match the index are skipped; new or changed ones are processed in a process pool.
+    Returns the index, mapping each source URL (e.g. "images/obrazy/1.jpg") to its record.
+    """
+    index = load_index()
+    updated = {}
+    pending = []
+    for url, stat in scan_sources():
+        entry = index.get(url)
+        if entry and entry.get("mtime") == stat.st_mtime_ns and entry.get("size") == stat.st_size \
+                and entry.get("params") == PARAMS_KEY:
+            updated[url] = entry
+        else:
+            pending.append((url, stat))
+
+    if pending:
+        print(f"Generating image derivatives for {len(pending)} images...")
+        paths = [str(BASE_DIR / url) for url, _ in pending]
+        if len(pending) == 1:
+            results = [_process_source_safe(paths[0])]
+        else:
+            # Spawned workers stay safe when the build runs in a thread of the API process.
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = list(pool.map(_process_source_safe, paths))
+        for (url, stat), (record, error) in zip(pending, results):
+            entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "params": PARAMS_KEY}
+            if error:
+                # Recorded so the image is not retried until it changes.
+                print(f"Warning: Could not generate derivatives for {url}: {error}")
+                entry["error"] = error
+            else:
+                entry.update(record)
+            updated[url] = entry
+
+    if updated != index:
+        save_index(updated)
+    return updated
+
+
+def responsive_images(index):
+    """
+    Converts derivative records into what templates need: srcset strings per format,
+    intrinsic dimensions and the placeholder data URI. Failed sources are left out.
+    """
+    images = {}
+    for url, entry in index.items():
+        if "variants" not in entry:
+            continue
+        images[url] = {
+            "width": entry["width"],
+            "height": entry["height"],
+            "placeholder": entry["placeholder"],
+            "srcset": {
+                name: ", ".join(f"{path} {w}w" for w, path in entries)
+                for name, entries in entry["variants"].items()
+            },
+        }
+    return images
+
+
+if __name__ == "__main__":
+    results = update_derivatives()
+    print(f"{len(results)} images indexed in {INDEX_PATH}")
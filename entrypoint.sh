@@ -6,13 +6,26 @@
 # Navigate to the mariadmin directory first
 cd mariadmin && npm run dev &
 
+# Write the cache-header include generated by build.py, as nginx only reads it at startup.
+python3 static_output.py
+
 # Start Nginx in the background.
 # The `&` symbol runs the command in a subshell in the background,
 # allowing the script to continue to the next command.
 nginx &
 
+# Generate the responsive image derivatives of new images before the API starts, so the
+# first build triggered through the API does not spend minutes on them while holding the
+# build lock. Only images added since the last run are processed.
+python3 derivatives.py
+
+# Build the site before the API starts: the pages and the data/ snapshots are build output and
+# not part of the image. Pages whose inputs did not change are left as they are.
+python3 build.py
+
 # Start Uvicorn in the foreground.
 # The `exec` command replaces the current shell process with the Uvicorn process.
 # This is important because it ensures that signals (like SIGTERM from Docker)
 # are directly passed to Uvicorn, allowing for graceful shutdown.
-exec uvicorn api:app --host 0.0.0.0 --port 8000
+# Workers share data writes and builds through file locks (see storage.py and build.py).
+exec uvicorn api:app --host 0.0.0.0 --port 8000 --workers "${API_WORKERS:-$(nproc)}"
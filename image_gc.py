@@ -0,0 +1,221 @@
+#! python3
+"""
+Garbage collection for images/: removes images that nothing references and stores
+byte-identical images only once.
+
+An image is referenced if a data record mentions it (a painting's filename, or an
+"images/..." path anywhere in a record), if a template, the CSS/JS assets or a published
+page mentions it, or if it lies in a directory a template lists as a whole (e.g.
+images/galerie, see build.DATA_SOURCES). Everything else, such as replaced uploads or old
+copies like images/galerie_backup, is removed. Files modified within the last `min_age`
+seconds are kept, as an upload is saved to its record only after it has been stored.
+
+Referenced images with the same content (by the SHA-256 in image_metadata's index, which is
+brought up to date in parallel first) are hard-linked to one copy, so every URL keeps
+working. Derivative directories (see derivatives.py) that no remaining image uses are removed.
+
+Usage:
+    python3 image_gc.py --dry-run
+    python3 image_gc.py
+"""
+import os
+import re
+import html
+import time
+import shutil
+import argparse
+from pathlib import Path
+from urllib.parse import unquote
+
+import build
+import derivatives
+import image_metadata
+from storage import get_repository
+
+# --- Configuration ---
+BASE_DIR = Path(__file__).resolve().parent
+IMAGES_DIR = BASE_DIR / "images"
+# Sources of references besides the data: templates, assets and published pages.
+REFERENCE_GLOBS = ("src/*.html", "assets/css/*.css", "assets/js/*.js", "*.html")
+# Upload folders are kept even when they end up empty.
+KEPT_DIRS = {"obrazy", "galerie", "projekty", "vystavy"}
+DEFAULT_MIN_AGE = 3600
+
+# "images/..." in a text: quoted, as in src="images/bg.jpg" or url("../../images/bg/new_bg.jpg"),
+# where names may contain spaces and parentheses, or bare, as in url(../../images/bg.jpg).
+QUOTED_REFERENCE = re.compile(r"""["']\s*[./]*(images/[^"'?#]+)""")
+BARE_REFERENCE = re.compile(r"""images/[^"'\s()<>?#]+""")
+
+
+# --- References ---
+def find_references(text: str):
+    matches = QUOTED_REFERENCE.findall(text) + BARE_REFERENCE.findall(text)
+    return {unquote(html.unescape(match)).strip() for match in matches}
+
+
+def record_references(value):
+    """Every image path mentioned in a record's values, at any depth."""
+    if isinstance(value, str):
+        # A field holding a path (e.g. a project's 'image'), or HTML that mentions images.
+        path = value.strip().lstrip("/")
+        return find_references(value) | ({path} if path.startswith(f"{IMAGES_DIR.name}/") else set())
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return set().union(*(record_references(item) for item in value))
+    return set()
+
+
+def referenced_images():
+    """Returns (referenced image URLs, directories whose every file is referenced)."""
+    references = set()
+    for key in build.DATA_SOURCES.values():
+        kind, _, name = key.partition(":")
+        if kind != "data":
+            continue
+        # A StorageError stops the collection: without the records nothing can be told apart from garbage.
+        records = get_repository(build.DATA_DIR / name).load()
+        for record in records:
+            references |= record_references(record)
+            if name == "paintings.json" and record.get("filename"):
+                references.add(f"{IMAGES_DIR.name}/obrazy/{record['filename']}")
+    for pattern in REFERENCE_GLOBS:
+        for path in BASE_DIR.glob(pattern):
+            references |= find_references(path.read_text(encoding="utf-8", errors="replace"))
+    directories = {name for kind, _, name in (key.partition(":") for key in build.DATA_SOURCES.values()) if kind == "dir"}
+    return {reference.lstrip("/") for reference in references}, directories
+
+
+def is_referenced(url: str, references, directories) -> bool:
+    return url in references or any(url.startswith(f"{directory}/") for directory in directories)
+
+
+# --- Collection ---
+def reclaimable_bytes(paths):
+    """Bytes freed by unlinking `paths`: a file's data is only freed with its last hard link."""
+    inodes = {}
+    for path in paths:
+        stat = path.stat()
+        links, size, count = inodes.get((stat.st_dev, stat.st_ino), (stat.st_nlink, stat.st_size, 0))
+        inodes[(stat.st_dev, stat.st_ino)] = (links, size, count + 1)
+    return sum(size for links, size, count in inodes.values() if count >= links)
+
+
+def directory_size(path: Path) -> int:
+    return sum(entry.stat().st_size for entry in path.rglob("*") if entry.is_file())
+
+
+def link_duplicate(canonical: Path, duplicate: Path):
+    # Linked under a temporary name and renamed over the duplicate, so the path never goes missing.
+    tmp_path = duplicate.with_name(f".{duplicate.name}.gc.tmp")
+    os.link(canonical, tmp_path)
+    os.replace(tmp_path, duplicate)
+
+
+def collect(dry_run: bool = False, min_age: float = DEFAULT_MIN_AGE, max_workers=None):
+    """
+    Removes unreferenced images, hard-links duplicates and removes unused derivatives.
+    With dry_run, only reports what would be done. Returns the report.
+    """
+    with build.BUILD_LOCK:
+        index = image_metadata.update_index(max_workers=max_workers)
+        references, directories = referenced_images()
+        now = time.time()
+        report = {'dry_run': dry_run, 'orphans': [], 'duplicates': [], 'derivatives': [], 'recent': [], 'errors': []}
+
+        orphans, kept = [], []
+        for url in sorted(index):
+            path = BASE_DIR / url
+            if is_referenced(url, references, directories):
+                kept.append(url)
+            elif now - path.stat().st_mtime < min_age:
+                report['recent'].append(url)
+            else:
+                orphans.append(path)
+                report['orphans'].append({'path': url, 'size': index[url]['size']})
+
+        # Duplicates: the first path of each content hash stays, the others become links to it.
+        canonical, duplicates = {}, []
+        for url in kept:
+            digest = index[url].get('sha256')
+            if not digest:
+                continue
+            if digest not in canonical:
+                canonical[digest] = url
+                continue
+            original, path = BASE_DIR / canonical[digest], BASE_DIR / url
+            if os.path.samefile(original, path):
+                continue
+            duplicates.append((original, path))
+            report['duplicates'].append({'path': url, 'canonical': canonical[digest], 'size': index[url]['size']})
+
+        # Derivatives are used by the derivative index's entries of the images that stay.
+        removed = {path.relative_to(BASE_DIR).as_posix() for path in orphans}
+        used_keys = {entry.get('key') for url, entry in derivatives.load_index().items() if url not in removed}
+        unused_derivatives = []
+        if derivatives.DERIVATIVES_DIR.is_dir():
+            for path in sorted(derivatives.DERIVATIVES_DIR.iterdir()):
+                if path.is_dir() and not path.name.startswith(".") and path.name not in used_keys:
+                    unused_derivatives.append(path)
+                    report['derivatives'].append({'path': path.relative_to(BASE_DIR).as_posix(), 'size': directory_size(path)})
+
+        report['reclaimed_bytes'] = reclaimable_bytes(orphans + [path for _, path in duplicates]) \
+            + sum(entry['size'] for entry in report['derivatives'])
+        if dry_run:
+            return report
+
+        for path in orphans:
+            try:
+                path.unlink()
+            except OSError as e:
+                report['errors'].append(f"{path.relative_to(BASE_DIR).as_posix()}: {e}")
+        linked = {}
+        for original, path in duplicates:
+            try:
+                link_duplicate(original, path)
+                linked[path] = index[original.relative_to(BASE_DIR).as_posix()]
+            except OSError as e:
+                report['errors'].append(f"{path.relative_to(BASE_DIR).as_posix()}: {e}")
+        for path in unused_derivatives:
+            shutil.rmtree(path, ignore_errors=True)
+
+        # Folders emptied by the collection (e.g. images/galerie_backup) go too, deepest first.
+        for directory in sorted({path.parent for path in orphans}, key=lambda path: len(path.parts), reverse=True):
+            while directory != IMAGES_DIR and directory.name not in KEPT_DIRS and not any(directory.iterdir()):
+                directory.rmdir()
+                directory = directory.parent
+
+        # Linked paths have their canonical file's mtime now; their metadata is the same.
+        image_metadata.add_entries({path: image_metadata.public_fields(entry) for path, entry in linked.items()})
+        image_metadata.update_index(orphans)
+        return report
+
+
+def format_size(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Remove unreferenced images and store duplicate images once.")
+    parser.add_argument("--dry-run", action="store_true", help="show what would be removed without changing anything")
+    parser.add_argument("--min-age", type=float, default=DEFAULT_MIN_AGE,
+                        help=f"keep unreferenced files modified within this many seconds (default: {DEFAULT_MIN_AGE})")
+    parser.add_argument("--workers", type=int, help="processes used to hash images (default: CPU count)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = collect(args.dry_run, args.min_age, args.workers)
+    for entry in report['orphans']:
+        print(f"  - unreferenced: {entry['path']} ({format_size(entry['size'])})")
+    for entry in report['duplicates']:
+        print(f"  - duplicate of {entry['canonical']}: {entry['path']} ({format_size(entry['size'])})")
+    for entry in report['derivatives']:
+        print(f"  - unused derivatives: {entry['path']} ({format_size(entry['size'])})")
+    for error in report['errors']:
+        print(f"Error: {error}")
+    verb = "Would reclaim" if args.dry_run else "Reclaimed"
+    print(f"{verb} {format_size(report['reclaimed_bytes'])}: {len(report['orphans'])} unreferenced images, "
+          f"{len(report['duplicates'])} duplicates, {len(report['derivatives'])} unused derivative folders"
+          f" ({len(report['recent'])} recent files kept).")
@@ -0,0 +1,214 @@
+#! python3
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from storage import FileLock
+
+# --- Configuration ---
+BASE_DIR = Path(__file__).resolve().parent
+IMAGES_DIR = BASE_DIR / "images"
+# Sidecar index of every image under IMAGES_DIR, keyed by URL (e.g. "images/obrazy/1.jpg").
+# A dotfile, so it is neither served by nginx nor picked up as an image itself.
+INDEX_PATH = IMAGES_DIR / ".metadata.json"
+# Serializes updates of the index across threads and processes (API workers and builds).
+INDEX_LOCK = FileLock(IMAGES_DIR / ".metadata.lock")
+EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+# Generated files are described by derivatives.py's own index.
+EXCLUDED_DIRS = {"_derivatives"}
+COLOR_SAMPLE_SIZE = 64
+# Bump when the recorded fields change, so existing entries are recomputed.
+VERSION = 1
+
+
+# --- Helpers ---
+def relative_url(path: Path) -> str:
+    return path.resolve().relative_to(BASE_DIR).as_posix()
+
+
+def load_index():
+    if not INDEX_PATH.is_file():
+        return {}
+    try:
+        with open(INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        return index if isinstance(index, dict) else {}
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+
+def save_index(index):
+    tmp_path = INDEX_PATH.with_name(f"{INDEX_PATH.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, INDEX_PATH)
+
+
+def scan_images():
+    """Yields (url, stat) for every image under IMAGES_DIR, skipping hidden and generated folders."""
+    for root, dirs, files in os.walk(IMAGES_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in EXCLUDED_DIRS]
+        for name in files:
+            if name.startswith(".") or Path(name).suffix.lower() not in EXTENSIONS:
+                continue
+            path = Path(root) / name
+            yield relative_url(path), path.stat()
+
+
+def is_current(entry, stat) -> bool:
+    return bool(entry) and entry.get("mtime") == stat.st_mtime_ns and entry.get("size") == stat.st_size \
+        and entry.get("version") == VERSION
+
+
+# --- Metadata Extraction (runs in worker processes) ---
+def dominant_color(image: Image.Image) -> str:
+    """Returns the most common colour of a small, quantized copy of the image as #rrggbb."""
+    # For JPEGs, draft() decodes at a reduced scale, which avoids decoding the full image.
+    image.draft("RGB", (COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    # Palette images with transparency go through RGBA, as Pillow warns on a direct conversion.
+    sample = (image.convert("RGBA") if image.mode == "P" else image).convert("RGB")
+    sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    quantized = sample.quantize(colors=5)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def read_metadata(source_path: str):
+    """Returns the metadata of one image file."""
+    path = Path(source_path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    with Image.open(path) as image:
+        width, height = image.size
+        orientation = image.getexif().get(0x0112, 1)
+        image_format = image.format
+        color = dominant_color(image)
+    # Orientations 5-8 are rotated by 90 degrees; width and height are as displayed.
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return {
+        "width": width,
+        "height": height,
+        "orientation": orientation,
+        "format": image_format,
+        "sha256": digest.hexdigest(),
+        "color": color,
+    }
+
+
+def _read_metadata_safe(source_path: str):
+    try:
+        return read_metadata(source_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _read_all(paths, max_workers=None):
+    if len(paths) == 1:
+        return [_read_metadata_safe(paths[0])]
+    # Spawned workers stay safe when this runs in a thread of the API process.
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(_read_metadata_safe, paths, chunksize=8))
+
+
+# --- Public API ---
+def update_index(paths=None, max_workers=None):
+    """
+    Brings the index up to date and returns it. Without `paths` every image under IMAGES_DIR
+    is considered and entries of deleted files are dropped; with `paths`, only those files are.
+    Files whose mtime and size match their entry are skipped; the others are read in a process pool.
+    """
+    with INDEX_LOCK:
+        index = load_index()
+        updated = dict(index) if paths is not None else {}
+        if paths is None:
+            candidates = scan_images()
+        else:
+            candidates = []
+            for path in paths:
+                url = relative_url(Path(path))
+                try:
+                    candidates.append((url, (BASE_DIR / url).stat()))
+                except FileNotFoundError:
+                    updated.pop(url, None)
+
+        pending = []
+        for url, stat in candidates:
+            if is_current(index.get(url), stat):
+                updated[url] = index[url]
+            else:
+                pending.append((url, stat))
+
+        if pending:
+            if len(pending) > 1:
+                print(f"Reading image metadata for {len(pending)} images...")
+            results = _read_all([str(BASE_DIR / url) for url, _ in pending], max_workers)
+            for (url, stat), (metadata, error) in zip(pending, results):
+                entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "version": VERSION}
+                if error:
+                    # Recorded so the file is not retried until it changes.
+                    print(f"Warning: Could not read image metadata for {url}: {error}")
+                    entry["error"] = error
+                else:
+                    entry.update(metadata)
+                updated[url] = entry
+
+        if updated != index:
+            save_index(updated)
+        return updated
+
+
+def add_entries(entries):
+    """
+    Records metadata that was already read (e.g. by scripts/ingest.py) for the given paths,
+    as {path: metadata}, so the files are not read again.
+    """
+    with INDEX_LOCK:
+        index = load_index()
+        for path, metadata in entries.items():
+            stat = Path(path).stat()
+            index[relative_url(Path(path))] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "version": VERSION, **metadata}
+        save_index(index)
+
+
+class MetadataCache:
+    """The index as last written to disk, reloaded when the file changes (e.g. after a build)."""
+
+    def __init__(self):
+        self._key = None
+        self.entries = {}
+        self.version = "empty"
+        self.modified = 0.0  # mtime of the index file, in seconds since the epoch
+
+    def refresh(self) -> "MetadataCache":
+        try:
+            stat = INDEX_PATH.stat()
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+        if key != self._key:
+            self.entries = load_index() if key else {}
+            self.version = f"{key[1]}-{key[2]}" if key else "empty"
+            self.modified = key[1] / 1e9 if key else 0.0
+            self._key = key
+        return self
+
+
+def public_fields(entry):
+    """The fields of an entry that are exposed to templates and API clients, or None."""
+    if not entry or "error" in entry:
+        return None
+    return {field: entry[field] for field in ("width", "height", "orientation", "format", "sha256", "color")}
+
+
+if __name__ == "__main__":
+    results = update_index()
+    print(f"{len(results)} images indexed in {INDEX_PATH}")
@@ -0,0 +1,238 @@
+#! python3
+import time
+import bisect
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+# --- Configuration ---
+# Bucket upper bounds in seconds: requests and file operations, and whole builds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUILD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+# --- Metric Types ---
+# A small, dependency-free implementation of the Prometheus text format (version 0.0.4).
+# Every metric is thread-safe, as the API records from worker threads (builds, file I/O).
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            if key not in self._children:
+                self._children[key] = self._new_child()
+            return self._children[key]
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self, key, child):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            lines.extend(self._samples(key, child))
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Context manager that observes the elapsed wall time of its block."""
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _samples(self, key, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render() -> str:
+    """Returns every registered metric in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Metrics ---
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency by route template.", ("method", "route", "status"))
+DATA_LOAD_SECONDS = Histogram(
+    "data_file_load_duration_seconds", "Time to read and parse a JSON data file.", ("file",))
+DATA_SAVE_SECONDS = Histogram(
+    "data_file_save_duration_seconds", "Time to atomically write a JSON data file.", ("file",))
+UPLOAD_BYTES = Counter(
+    "upload_bytes_total", "Bytes of uploaded images received, by target folder.", ("resource",))
+BUILD_QUEUE_DEPTH = Gauge(
+    "build_queue_depth", "Builds waiting or running in the API's build scheduler.")
+BUILD_SECONDS = Histogram(
+    "build_duration_seconds", "Duration of whole site builds.", ("status",), buckets=BUILD_BUCKETS)
+BUILD_PHASE_SECONDS = Histogram(
+    "build_phase_duration_seconds", "Time spent in each build phase.", ("phase",), buckets=BUILD_BUCKETS)
+BUILD_TEMPLATE_SECONDS = Histogram(
+    "build_template_render_seconds", "Render time of each page template.", ("template",))
+BUILD_FAILURES = Counter(
+    "build_failures_total", "Builds that raised an error or failed to render a page.", ("reason",))
+BUILD_LAST_TIMESTAMP = Gauge(
+    "build_last_finished_timestamp_seconds", "When the last recorded build finished, by status.", ("status",))
+
+_recorded_builds = set()
+_recorded_builds_lock = threading.Lock()
+
+
+def record_build(stats: Optional[dict]):
+    """
+    Records the structured stats of one build (see build.py) in the build metrics. Each build
+    is recorded once, so this can be fed both from in-process builds and from the stats file
+    that command-line builds leave behind.
+    """
+    if not stats or not stats.get('id') or stats.get('status') == 'running':
+        return
+    with _recorded_builds_lock:
+        if stats['id'] in _recorded_builds:
+            return
+        _recorded_builds.add(stats['id'])
+    status = stats.get('status', 'ok')
+    BUILD_SECONDS.labels(status=status).observe(stats.get('duration', 0.0))
+    BUILD_LAST_TIMESTAMP.labels(status=status).set(stats.get('finished_at', 0.0))
+    for phase, seconds in stats.get('timings', {}).items():
+        BUILD_PHASE_SECONDS.labels(phase=phase).observe(seconds)
+    for template, seconds in stats.get('templates', {}).items():
+        BUILD_TEMPLATE_SECONDS.labels(template=template).observe(seconds)
+    if status == 'error':
+        BUILD_FAILURES.labels(reason="error").inc()
+    elif stats.get('failed'):
+        BUILD_FAILURES.labels(reason="render").inc()
+
+
+# --- ASGI Middleware ---
+class RequestMetricsMiddleware:
+    """
+    Times every HTTP request, labelled with the route template (e.g. /paintings/{painting_id})
+    rather than the raw path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the (shared) scope.
+            route = scope.get("route")
+            template = (getattr(route, "path", "") or "/") if route is not None else "unmatched"
+            HTTP_REQUEST_SECONDS.labels(method=scope["method"], route=template, status=status[0]).observe(
+                time.perf_counter() - start)
@@ -83,6 +83,7 @@ def add_order_to_json(filepath: Path):
 
 
 if __name__ == "__main__":
+    # Superseded by scripts/ingest.py, which does the same with a dry run, resume and backups.
     # WARNING: RUN THIS SCRIPT ONLY ONCE!
     # It will rename your image files and create paintings.json.
 
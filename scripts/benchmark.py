@@ -0,0 +1,399 @@
+#! python3
+"""
+Benchmarks the build pipeline and the API against synthetic catalogues.
+
+For every size a throwaway copy of the site is created in a temp directory, with synthetic
+paintings.json, projekty.json and vystavy.json and a matching image tree. A separate process
+then measures the build phases (cold, no-op and after one data change) and drives the API
+through an in-process ASGI client under concurrent load. Runs offline; nothing in the
+repository is modified.
+
+Usage:
+    python3 scripts/benchmark.py                          # 100, 1k, 10k and 100k items
+    python3 scripts/benchmark.py --sizes 100 1000 --concurrency 32
+    python3 scripts/benchmark.py --compare benchmarks/old.json benchmarks/new.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+# --- Configuration ---
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_DIR / "benchmarks"
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+# Modules and directories copied into every workspace (the data is replaced by synthetic data).
+CODE_FILES = ("api.py", "build.py", "derivatives.py", "image_gc.py", "image_metadata.py", "metrics.py", "search_index.py", "static_output.py", "storage.py")
+ENDPOINTS = ("list", "list_page", "list_resource", "get", "update", "move", "reorder", "upload", "upload_resource")
+# Endpoints that rewrite a whole data file; they run `--write-requests` times instead of `--requests`.
+WRITE_ENDPOINTS = {"update", "move", "reorder", "upload"}
+
+TITLE_WORDS = ("Návrat", "ke", "kořenům", "Ticho", "před", "bouří", "Žlutá", "řeka", "Světlo", "stín",
+               "Ranní", "mlha", "nad", "Šumavou", "Čas", "léto", "Zahrada", "Dívka", "s", "květinou")
+PLACES = ("Praha", "Plzeň", "Dobřany", "Brno", "Klatovy", "České Budějovice")
+MONTHS = ("Leden", "Únor", "Březen", "Duben", "Květen", "Červen",
+          "Červenec", "Srpen", "Září", "Říjen", "Listopad", "Prosinec")
+
+
+# --- Synthetic Data ---
+def synthetic_title(rng: random.Random) -> str:
+    return " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 5))).capitalize()
+
+
+def synthetic_date(rng: random.Random) -> str:
+    return f"{rng.choice(MONTHS)} {rng.randint(2010, 2025)}, {rng.choice(PLACES)}"
+
+
+def synthetic_links(rng: random.Random):
+    return [{"url": f"https://example.com/{rng.getrandbits(64):x}", "text": f"Galerie {n + 1}"}
+            for n in range(rng.randint(0, 3))]
+
+
+def generate_data(size: int, rng: random.Random):
+    """Returns (paintings, projekty, vystavy) in the formats stored in src/data."""
+    paintings = [
+        {"id": i, "title": synthetic_title(rng), "sold": rng.random() < 0.3, "order": i - 1, "filename": f"{i}.jpg"}
+        for i in range(1, size + 1)
+    ]
+    projekty = [
+        {"id": i, "order": i - 1, "date": synthetic_date(rng), "title": synthetic_title(rng),
+         "image": f"images/projekty/{i}.jpg", "description": synthetic_title(rng) if rng.random() < 0.5 else None,
+         "links": synthetic_links(rng), "video_url": None}
+        for i in range(1, size + 1)
+    ]
+    vystavy = [
+        {"id": i, "order": i - 1, "date": synthetic_date(rng), "title": synthetic_title(rng),
+         "image": f"images/vystavy/{i}.jpg", "links": synthetic_links(rng)}
+        for i in range(1, size + 1)
+    ]
+    return paintings, projekty, vystavy
+
+
+def synthetic_jpeg(seed: int, width: int = 480, height: int = 360) -> bytes:
+    """A small JPEG with a per-seed gradient, so every image has distinct content."""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    start = [rng.randrange(256) for _ in range(3)]
+    end = [rng.randrange(256) for _ in range(3)]
+    image = Image.linear_gradient("L").resize((width, height))
+    bands = [image.point(lambda v, a=a, b=b: a + (b - a) * v // 255) for a, b in zip(start, end)]
+    buffer = io.BytesIO()
+    Image.merge("RGB", bands).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def create_workspace(root: Path, size: int, distinct_images: int, seed: int):
+    """
+    Copies the site code, templates and assets into root and fills it with synthetic data.
+    Every record gets an image file; beyond `distinct_images` they are hard links to the
+    distinct ones, which keeps large trees cheap while still listing one file per record.
+    """
+    rng = random.Random(seed)
+    for name in CODE_FILES:
+        shutil.copy2(REPO_DIR / name, root / name)
+    shutil.copytree(REPO_DIR / "src", root / "src", ignore=shutil.ignore_patterns("data", "*.egg-info"))
+    shutil.copytree(REPO_DIR / "assets", root / "assets")
+    shutil.copy2(REPO_DIR / "container.html", root / "container.html")
+    (root / "dist" / "assets").mkdir(parents=True)  # mounted by api.py
+
+    data_dir = root / "src" / "data"
+    data_dir.mkdir()
+    for name, items in zip(("paintings", "projekty", "vystavy"), generate_data(size, rng)):
+        with open(data_dir / f"{name}.json", "w", encoding="utf-8") as f:
+            json.dump(items, f, indent=2, ensure_ascii=False)
+
+    images_dir = root / "images"
+    originals = images_dir / ".synthetic"
+    originals.mkdir(parents=True)
+    distinct = []
+    for n in range(min(size, distinct_images)):
+        path = originals / f"{n}.jpg"
+        path.write_bytes(synthetic_jpeg(seed + n))
+        distinct.append(path)
+    for dir_name, names in (
+        ("obrazy", [f"{i}.jpg" for i in range(1, size + 1)]),
+        ("projekty", [f"{i}.jpg" for i in range(1, size + 1)]),
+        ("vystavy", [f"{i}.jpg" for i in range(1, size + 1)]),
+        # Galerie files are sorted by their numeric prefix (see build.get_galerie_sort_key).
+        ("galerie", [f"{i}_{i}.jpg" for i in range(1, size + 1)]),
+    ):
+        target_dir = images_dir / dir_name
+        target_dir.mkdir()
+        for n, name in enumerate(names):
+            os.link(distinct[n % len(distinct)], target_dir / name)
+
+
+# --- Measurements (run inside the workspace process) ---
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, elapsed: float, errors: int):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def measure_build(optimize: bool):
+    import build as site_build
+    from storage import get_repository
+
+    builder = site_build.SiteBuilder(optimize_static=optimize, responsive_images=True)
+    results = {}
+
+    def run(label, **kwargs):
+        start = time.perf_counter()
+        summary = builder.build(**kwargs)
+        results[label] = {
+            "total_s": round(time.perf_counter() - start, 4),
+            "phases_s": {phase: round(seconds, 4) for phase, seconds in summary['timings'].items()},
+            "rendered": len(summary['rendered']) + len(summary['unchanged']),
+            "skipped": len(summary['skipped']),
+            "failed": len(summary['failed']),
+        }
+
+    # Cold: derivatives are generated for every image and every page is rendered.
+    run("cold", force=True)
+    # No-op: nothing changed, so every page should be skipped.
+    run("noop")
+    # Incremental: one painting changed, so only the pages that use paintings are rendered.
+    def rename_first(paintings):
+        paintings[0]['title'] += " (upraveno)"
+    get_repository(site_build.DATA_DIR / "paintings.json").update(rename_first)
+    run("incremental")
+    return results
+
+
+async def measure_api(size: int, concurrency: int, requests: int, write_requests: int, seed: int):
+    import httpx
+    import api
+
+    rng = random.Random(seed)
+    ids = list(range(1, size + 1))
+    image = synthetic_jpeg(seed)
+    counter = iter(range(10 ** 9))
+
+    def unique_image():
+        # Trailing bytes after the JPEG end marker keep each upload distinct, so none are deduplicated.
+        return image + next(counter).to_bytes(8, "big")
+
+    def reorder_payload():
+        shuffled = ids[:]
+        rng.shuffle(shuffled)
+        return {"ids": shuffled}
+
+    def make_request(name):
+        if name == "list":
+            return "GET", "/paintings", {}
+        if name == "list_page":
+            return "GET", "/paintings", {"params": {"limit": 50, "fields": "id,title,url",
+                                                    "title_prefix": rng.choice(TITLE_WORDS)[:2]}}
+        if name == "list_resource":
+            return "GET", "/projekty", {}
+        if name == "get":
+            return "GET", f"/paintings/{rng.choice(ids)}", {}
+        if name == "update":
+            return "PUT", f"/paintings/{rng.choice(ids)}", {"json": {"title": synthetic_title(rng)}}
+        if name == "move":
+            item_id, neighbour = rng.sample(ids, 2)
+            return "POST", f"/paintings/{item_id}/move", {"json": {"before": neighbour}}
+        if name == "reorder":
+            return "POST", "/paintings/reorder", {"json": reorder_payload()}
+        if name == "upload":
+            return "POST", "/paintings", {"data": {"title": synthetic_title(rng)},
+                                          "files": {"image": ("bench.jpg", unique_image(), "image/jpeg")}}
+        return "POST", "/upload/projekty", {"files": {"image": ("bench.jpg", unique_image(), "image/jpeg")}}
+
+    transport = httpx.ASGITransport(app=api.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for name in ENDPOINTS:
+            total = write_requests if name in WRITE_ENDPOINTS else requests
+            # Requests are prepared up front so payload generation is not part of the latency.
+            pending = [make_request(name) for _ in range(total)]
+            latencies, errors = [], 0
+
+            async def worker():
+                nonlocal errors
+                while pending:
+                    method, url, kwargs = pending.pop()
+                    start = time.perf_counter()
+                    response = await client.request(method, url, **kwargs)
+                    await response.aread()
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+            results[name] = summarize(latencies, time.perf_counter() - start, errors)
+            print(f"  {name}: {results[name]}", file=sys.stderr)
+    return results
+
+
+def run_worker(args):
+    """Entry point of the per-size process; the workspace is first on sys.path, so its modules are imported."""
+    # Builds triggered by writes would compete with the measured requests; keep them queued instead.
+    os.environ["BUILD_DEBOUNCE_SECONDS"] = "3600"
+    os.environ["STORAGE_BACKEND"] = args.backend
+    sys.path.insert(0, str(args.worker))
+    os.chdir(args.worker)
+    if args.backend == "sqlite":
+        import storage
+        storage.import_json()
+    result = {"build": measure_build(args.optimize)}
+    result["api"] = asyncio.run(measure_api(
+        args.worker_size, args.concurrency, args.requests, args.write_requests, args.seed))
+    with open(args.worker_output, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+# --- Orchestration ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(size: int, args):
+    with tempfile.TemporaryDirectory(prefix=f"benchmark-{size}-") as tmp:
+        workspace = Path(tmp) / "site"
+        workspace.mkdir()
+        start = time.perf_counter()
+        create_workspace(workspace, size, args.images, args.seed)
+        setup = time.perf_counter() - start
+        output = Path(tmp) / "result.json"
+        command = [
+            sys.executable, str(Path(__file__).resolve()), "--worker", str(workspace),
+            "--worker-size", str(size), "--worker-output", str(output),
+            "--concurrency", str(args.concurrency), "--requests", str(args.requests),
+            "--write-requests", str(args.write_requests), "--seed", str(args.seed),
+        ]
+        if args.optimize:
+            command.append("--optimize")
+        command += ["--backend", args.backend]
+        # The build's progress output is only shown with --verbose.
+        subprocess.run(command, check=True, stdout=None if args.verbose else subprocess.DEVNULL)
+        with open(output, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        result["setup_s"] = round(setup, 4)
+        return result
+
+
+def compare(old_path: Path, new_path: Path):
+    """Prints the relative change of every metric that is present in both result files."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for size, new_result in new["results"].items():
+        old_result = old["results"].get(size)
+        if not old_result:
+            continue
+        print(f"\n{size} items")
+        for label, new_run in new_result["build"].items():
+            old_run = old_result["build"].get(label)
+            if old_run:
+                print(f"  build {label:<12} {old_run['total_s']:>10.3f}s {new_run['total_s']:>10.3f}s "
+                      f"{format_change(old_run['total_s'], new_run['total_s'])}")
+        for name, new_stats in new_result["api"].items():
+            old_stats = old_result["api"].get(name)
+            if old_stats:
+                for metric in ("p50_ms", "p99_ms"):
+                    print(f"  {name:<15} {metric:<6} {old_stats[metric]:>10.2f} {new_stats[metric]:>10.2f} "
+                          f"{format_change(old_stats[metric], new_stats[metric])}")
+
+
+def format_change(old: float, new: float) -> str:
+    if not old:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark build.py and api.py on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="catalogue sizes (items per data file)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent in-flight API requests")
+    parser.add_argument("--requests", type=int, default=500, help="requests per read endpoint")
+    parser.add_argument("--write-requests", type=int, default=50,
+                        help="requests per endpoint that rewrites a data file (update, reorder, upload)")
+    parser.add_argument("--images", type=int, default=200,
+                        help="distinct synthetic images; larger trees reuse them through hard links")
+    parser.add_argument("--optimize", action="store_true", help="build with static optimization (see build.py)")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="storage backend (see storage.py)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="result file (default: benchmarks/<timestamp>-<commit>.json)")
+    parser.add_argument("--verbose", action="store_true", help="show the build output")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    # Internal: run the measurements for one prepared workspace.
+    parser.add_argument("--worker", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", type=Path, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit = git_commit()
+    results = {}
+    for size in args.sizes:
+        print(f"Benchmarking {size} items...")
+        results[str(size)] = run_size(size, args)
+        build_times = ", ".join(f"{label} {run['total_s']:.2f}s" for label, run in results[str(size)]["build"].items())
+        print(f"  build: {build_times}")
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": {
+                "concurrency": args.concurrency, "requests": args.requests,
+                "write_requests": args.write_requests, "images": args.images,
+                "optimize": args.optimize, "backend": args.backend, "seed": args.seed,
+            },
+        },
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+#! python3
+"""
+Imports a folder of images as paintings (or projekty/vystavy items), resumably and in parallel.
+
+Filenames follow the conventions of migrate.py and scripts/rename_obrazy.py:
+`[SOLD_]<id>_<order>_<title>.<ext>`, where `<id>_<order>_` is optional and a `_sold` suffix
+before the extension also marks a painting as sold. Any other name becomes the title as it is.
+
+The files are read (validated, measured and hashed) in a process pool and copied into the
+resource's image folder under hidden staging names. Every processed file is recorded in a
+journal next to the source files (.ingest-<resource>.journal), so an interrupted run resumes
+where it stopped. When all files are processed, the records are added in one repository update
+(a single atomic save), the staged copies get their final names and the journal is removed.
+Images already in the image folder (by content hash) are reused, and skipped if a record
+already uses them, so running an import twice does not duplicate it. Source files are left in
+place unless --move is given, which removes the imported ones (never skipped or unreadable files).
+
+Usage:
+    python3 scripts/ingest.py ~/Fotky/vystava-2025 --dry-run
+    python3 scripts/ingest.py ~/Fotky/vystava-2025 --build
+    python3 scripts/ingest.py ~/Fotky/vernisaz --resource vystavy
+    python3 scripts/ingest.py images/obrazy --move    # what migrate.py did, with a dry run and resume
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import image_metadata  # noqa: E402
+from storage import StorageError, get_repository  # noqa: E402
+
+# --- Configuration ---
+DATA_DIR = REPO_DIR / "src" / "data"
+IMAGES_DIR = REPO_DIR / "images"
+RESOURCES = {"paintings": "obrazy", "projekty": "projekty", "vystavy": "vystavy"}
+# Same spacing as api.py, so imported items can later be moved between their neighbours.
+ORDER_STEP = 1024
+STAGING_PREFIX = ".ingest-"
+# The journal is fsynced after this many files (and at the end); it is flushed after every file.
+JOURNAL_SYNC_EVERY = 50
+
+FILENAME_PATTERN = re.compile(r"^(?:(SOLD)_)?(?:(\d+)_(\d+)_)?(.+?)(_sold)?$", re.IGNORECASE)
+
+
+# --- Filenames ---
+def parse_filename(name: str):
+    """Returns the title, sold flag, id and order encoded in a filename; id and order may be None."""
+    sold_prefix, id_str, order_str, title, sold_suffix = FILENAME_PATTERN.match(Path(name).stem).groups()
+    return {
+        "title": title,
+        "sold": bool(sold_prefix or sold_suffix),
+        "id": int(id_str) if id_str else None,
+        "order": int(order_str) if order_str else None,
+    }
+
+
+def sanitize_filename(name: str) -> str:
+    # Same rules as api.py's uploads.
+    return re.sub(r'[\\/*?:"<>|]', "", name).strip()[:100]
+
+
+def image_url(resource: str, filename: str) -> str:
+    return f"images/{RESOURCES[resource]}/{filename}"
+
+
+def record_filename(resource: str, item):
+    """The name of the image file (in the resource's image folder) a record uses, or None."""
+    if resource == "paintings":
+        return item.get('filename')
+    prefix = image_url(resource, "")
+    image = (item.get('image') or "").lstrip("/")
+    return image[len(prefix):] if image.startswith(prefix) else None
+
+
+# --- Processing (runs in worker processes) ---
+def process_file(source: str, staging_dir):
+    """Reads and hashes one image and, unless staging_dir is None, copies it there under a staging name."""
+    try:
+        metadata = image_metadata.read_metadata(source)
+        if staging_dir:
+            staged = Path(staging_dir) / f"{STAGING_PREFIX}{metadata['sha256'][:32]}{Path(source).suffix.lower()}"
+            # Identical files share one staged copy, which may exist from an interrupted run.
+            if not staged.exists():
+                tmp = staged.with_name(f"{staged.name}.{os.getpid()}.tmp")
+                shutil.copy2(source, tmp)
+                with open(tmp, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp, staged)
+            metadata["staged"] = staged.name
+        return metadata
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# --- Journal ---
+def read_journal(path: Path, resource: str):
+    """
+    Returns ({source name: entry}, committed) from a journal left by an earlier run, where
+    committed is the names of the imported files if the import was committed, else None.
+    """
+    entries, committed = {}, None
+    if not path.is_file():
+        return entries, committed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # the last line of an interrupted write
+            if record.get("resource", resource) != resource:
+                sys.exit(f"Error: {path} belongs to an import of {record['resource']}.")
+            if "file" in record:
+                entries[record["file"]] = record
+            if record.get("committed"):
+                committed = set(record.get("files", []))
+    return entries, committed
+
+
+class JournalWriter:
+    def __init__(self, path: Path, resource: str):
+        new = not path.is_file()
+        self.file = open(path, "a", encoding="utf-8")
+        self.unsynced = 0
+        if new:
+            self.write({"resource": resource, "started_at": time.time()})
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= JOURNAL_SYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def is_journaled(entry, stat, target_dir: Path) -> bool:
+    if not entry or entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime_ns:
+        return False
+    return "error" in entry or not entry.get("staged") or (target_dir / entry["staged"]).exists()
+
+
+# --- Import ---
+def find_sources(source_dir: Path, target_dir: Path, referenced):
+    """Image files in source_dir, except hidden ones and (when importing in place) those records already use."""
+    sources = []
+    for entry in sorted(os.scandir(source_dir), key=lambda e: e.name):
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        if Path(entry.name).suffix.lower() not in image_metadata.EXTENSIONS:
+            continue
+        if source_dir == target_dir and entry.name in referenced:
+            continue
+        sources.append(Path(entry.path))
+    return sources
+
+
+def process_sources(sources, journaled, target_dir: Path, journal, workers, dry_run):
+    """Processes every source without a current journal entry; returns {source name: entry}."""
+    entries = {}
+    pending = []
+    for source in sources:
+        stat = source.stat()
+        entry = journaled.get(source.name)
+        if is_journaled(entry, stat, target_dir):
+            entries[source.name] = entry
+        else:
+            pending.append((source, stat))
+    if journaled and entries:
+        print(f"Resuming: {len(entries)} files already processed.")
+    if not pending:
+        return entries
+
+    print(f"Processing {len(pending)} files with {workers or os.cpu_count()} workers...")
+    staging_dir = None if dry_run else str(target_dir)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(process_file, str(source), staging_dir): (source, stat) for source, stat in pending}
+        for future in as_completed(futures):
+            source, stat = futures[future]
+            entry = {"file": source.name, "size": stat.st_size, "mtime": stat.st_mtime_ns, **future.result()}
+            entries[source.name] = entry
+            if journal:
+                journal.write(entry)
+            done += 1
+            if done % 100 == 0 or done == len(pending):
+                print(f"  {done}/{len(pending)}")
+    return entries
+
+
+def plan_import(resource, sources, entries, target_dir: Path, existing_items):
+    """
+    Returns the files to add, in import order, and the skipped ones with a reason. A file whose
+    content is already in the image folder reuses that file, and is skipped if a record uses it.
+    """
+    in_place = bool(sources) and sources[0].parent == target_dir
+    source_names = {source.name for source in sources} if in_place else set()
+    index = image_metadata.update_index()
+    folder = image_url(resource, "")
+    known = {}
+    for url, metadata in index.items():
+        name = url[len(folder):]
+        if url.startswith(folder) and "/" not in name and name not in source_names and metadata.get("sha256"):
+            known.setdefault(metadata["sha256"], name)
+    used_by = {}
+    for item in existing_items:
+        name = record_filename(resource, item)
+        if name:
+            used_by.setdefault(name, item.get('id'))
+
+    planned, skipped = [], []
+    for source in sources:
+        entry = entries[source.name]
+        if "error" in entry:
+            skipped.append((source.name, f"unreadable: {entry['error']}"))
+            continue
+        existing = known.get(entry["sha256"])
+        if existing and existing in used_by:
+            skipped.append((source.name, f"already imported as #{used_by[existing]} ({existing})"))
+            continue
+        planned.append({**entry, **parse_filename(source.name), "existing": existing, "suffix": source.suffix})
+    planned.sort(key=lambda e: (e["order"] is None, e["order"] or 0, e["file"]))
+    return planned, skipped
+
+
+def final_filename(resource, entry, new_id, target_dir: Path) -> str:
+    if resource == "paintings":
+        name = f"{new_id}{entry['suffix']}"
+    else:
+        name = sanitize_filename(entry["file"])
+    if (target_dir / name).exists():
+        name = f"{Path(name).stem}_{entry['sha256'][:8]}{Path(name).suffix}"
+    return name
+
+
+def commit(resource, planned, target_dir: Path):
+    """
+    Adds one record per planned file in a single repository update. Staged copies are renamed to
+    their final names inside the update and renamed back if it fails, so a failed commit can be retried.
+    Returns the new records and {final path: metadata} of the placed files.
+    """
+    repo = get_repository(DATA_DIR / f"{resource}.json")
+    placed = []  # (staged path, final path)
+
+    def add_records(items):
+        taken = {item.get('id') for item in items}
+        next_id = max((i for i in taken if isinstance(i, int)), default=0) + 1
+        order = max((item.get('order', 0) for item in items), default=-ORDER_STEP)
+        by_hash, records = {}, []
+        for entry in planned:
+            new_id = entry["id"] if entry["id"] is not None and entry["id"] not in taken else next_id
+            taken.add(new_id)
+            next_id = max(next_id, new_id + 1)
+            order += ORDER_STEP
+            filename = entry["existing"] or by_hash.get(entry["sha256"])
+            if not filename:
+                filename = final_filename(resource, entry, new_id, target_dir)
+                os.replace(target_dir / entry["staged"], target_dir / filename)
+                placed.append((target_dir / entry["staged"], target_dir / filename, entry))
+            by_hash[entry["sha256"]] = filename
+            if resource == "paintings":
+                record = {"id": new_id, "title": entry["title"], "sold": entry["sold"], "order": order, "filename": filename}
+            else:
+                record = {"id": new_id, "order": order, "title": entry["title"], "image": image_url(resource, filename), "links": []}
+            items.append(record)
+            records.append(record)
+        return records
+
+    try:
+        records = repo.update(add_records)
+    except BaseException:
+        for staged, final, _ in reversed(placed):
+            if final.exists() and not staged.exists():
+                os.replace(final, staged)
+        raise
+    fields = ("width", "height", "orientation", "format", "sha256", "color")
+    return records, {final: {k: entry[k] for k in fields} for _, final, entry in placed}
+
+
+def finish(journal_path: Path, entries, imported, target_dir: Path, move: bool):
+    """
+    Removes what is left after a commit: unused staged copies, the imported sources (with --move)
+    and the journal. Skipped and unreadable sources are never removed.
+    """
+    for staged in {entry["staged"] for entry in entries.values() if entry.get("staged")}:
+        (target_dir / staged).unlink(missing_ok=True)
+    if move:
+        for source in imported:
+            source.unlink(missing_ok=True)
+    journal_path.unlink(missing_ok=True)
+
+
+def ingest(source_dir: Path, resource: str, dry_run=False, move=False, workers=None, build=False):
+    source_dir = source_dir.resolve()
+    if not source_dir.is_dir():
+        sys.exit(f"Error: Directory not found - '{source_dir}'")
+    target_dir = IMAGES_DIR / RESOURCES[resource]
+    target_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        existing_items = get_repository(DATA_DIR / f"{resource}.json").load()
+    except StorageError as e:
+        sys.exit(f"Error: {e}")
+    referenced = {record_filename(resource, item) for item in existing_items}
+    sources = find_sources(source_dir, target_dir, referenced)
+
+    journal_path = source_dir / f".ingest-{resource}.journal"
+    journaled, committed = read_journal(journal_path, resource)
+    if committed is not None:
+        # Interrupted after the commit: only the cleanup is left.
+        if not dry_run:
+            finish(journal_path, journaled, [s for s in sources if s.name in committed], target_dir, move)
+        print("The previous import was already committed; cleaned up after it.")
+        return
+
+    journal = None if dry_run else JournalWriter(journal_path, resource)
+    try:
+        entries = process_sources(sources, journaled, target_dir, journal, workers, dry_run)
+    finally:
+        if journal:
+            journal.close()
+    planned, skipped = plan_import(resource, sources, entries, target_dir, existing_items)
+
+    for name, reason in skipped:
+        print(f"Skipping '{name}': {reason}")
+    if dry_run:
+        for entry in planned:
+            note = f" (reuses {entry['existing']})" if entry["existing"] else ""
+            sold = " [sold]" if entry["sold"] else ""
+            print(f"Would import '{entry['file']}' as '{entry['title']}'{sold}{note}")
+        print(f"\nDry run: {len(planned)} files would be imported, {len(skipped)} skipped. Nothing was changed.")
+        return
+
+    records, placed = commit(resource, planned, target_dir) if planned else ([], {})
+    imported = [entry["file"] for entry in planned]
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"committed": True, "ids": [r["id"] for r in records], "files": imported},
+                           ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    if placed:
+        image_metadata.add_entries(placed)
+    finish(journal_path, entries, [s for s in sources if s.name in imported], target_dir, move)
+
+    print(f"\nImported {len(records)} {resource} ({len(placed)} new files), skipped {len(skipped)}.")
+    if build and records:
+        import build as site_build
+        site_build.build()
+    elif records:
+        print("Run `python3 build.py` (or POST /build) to publish them.")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import a folder of images as paintings, projekty or vystavy.")
+    parser.add_argument("source", type=Path, help="folder with the images to import")
+    parser.add_argument("--resource", choices=sorted(RESOURCES), default="paintings")
+    parser.add_argument("--dry-run", action="store_true", help="show what would be imported without changing anything")
+    parser.add_argument("--move", action="store_true", help="delete the imported source files after a successful import")
+    parser.add_argument("--workers", type=int, help="processes used to read and copy files (default: CPU count)")
+    parser.add_argument("--build", action="store_true", help="build the site after importing")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ingest(args.source, args.resource, args.dry_run, args.move, args.workers, args.build)
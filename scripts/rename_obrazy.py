@@ -1,3 +1,4 @@
+# Superseded by scripts/ingest.py, which reads both the SOLD_ prefix and the _sold suffix as is.
 import os
 import re
 import sys
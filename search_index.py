@@ -0,0 +1,174 @@
+#! python3
+import re
+import bisect
+import html
+import json
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- Configuration ---
+# Indexed fields and their weights, per resource. 'date' holds the place of an exhibition
+# or project (e.g. "Březen 2024, Dobřany"), so it ranks between title and description.
+FIELDS = {
+    'paintings': {'title': 3},
+    'projekty': {'title': 3, 'date': 2, 'description': 1},
+    'vystavy': {'title': 3, 'date': 2},
+}
+# An exact token match scores this many times more than a token that only starts with the term.
+EXACT_MATCH_BONUS = 2
+STATIC_INDEX_VERSION = 1
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+TOKEN_PATTERN = re.compile(r"\w+")
+
+DocKey = Tuple[str, Any]
+
+
+# --- Text Folding ---
+def fold(text: str) -> str:
+    """
+    Casefolds text and strips its diacritics (every mark), so "Dobřany", "DOBRANY" and
+    "dobrany" are equal. assets/js/search.js folds queries the same way.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.category(c).startswith("M"))
+
+
+def plain_text(value) -> str:
+    """Text of a field as shown on the site: titles and descriptions may contain HTML."""
+    return html.unescape(TAG_PATTERN.sub(" ", str(value or ""))).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(fold(plain_text(text)))
+
+
+def document_terms(resource: str, record: Dict[str, Any]) -> Dict[str, int]:
+    """Returns {token: weight} for one record, summing the weights of the fields a token occurs in."""
+    terms: Dict[str, int] = {}
+    for field, weight in FIELDS.get(resource, {}).items():
+        for token in set(tokenize(record.get(field))):
+            terms[token] = terms.get(token, 0) + weight
+    return terms
+
+
+def document_summary(resource: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'resource': resource,
+        'id': record.get('id'),
+        'title': plain_text(record.get('title')),
+        'image': record.get('url') or record.get('image'),
+    }
+
+
+# --- Inverted Index ---
+class SearchIndex:
+    """
+    An in-memory inverted index from folded tokens to the records containing them. It is kept
+    up to date per resource with update(), which only re-indexes the records whose indexed
+    fields changed. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._documents: Dict[DocKey, Tuple[tuple, Dict[str, int], Dict[str, Any]]] = {}
+        self._postings: Dict[str, Dict[DocKey, int]] = {}
+        self._terms: Optional[List[str]] = []  # sorted tokens, for prefix lookups; None when stale
+        self._versions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def update(self, resource: str, records: List[Dict[str, Any]], version: Optional[str] = None) -> int:
+        """
+        Indexes a resource's current records. Pass the data version (see storage.Snapshot) to
+        make repeated calls for the same version free. Returns the number of records re-indexed.
+        """
+        with self._lock:
+            if version is not None and self._versions.get(resource) == version:
+                return 0
+            fields = tuple(FIELDS.get(resource, {})) + ('url', 'image')
+            current = {}
+            for record in records:
+                current[(resource, record.get('id'))] = tuple(str(record.get(f) or "") for f in fields), record
+            changed = 0
+            for key in [key for key in self._documents if key[0] == resource and key not in current]:
+                self._remove(key)
+                changed += 1
+            for key, (fingerprint, record) in current.items():
+                known = self._documents.get(key)
+                if known and known[0] == fingerprint:
+                    continue
+                if known:
+                    self._remove(key)
+                self._add(key, fingerprint, resource, record)
+                changed += 1
+            if version is not None:
+                self._versions[resource] = version
+            return changed
+
+    def _add(self, key: DocKey, fingerprint: tuple, resource: str, record: Dict[str, Any]):
+        terms = document_terms(resource, record)
+        self._documents[key] = (fingerprint, terms, document_summary(resource, record))
+        for token, weight in terms.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                self._terms = None
+            self._postings[token][key] = weight
+
+    def _remove(self, key: DocKey):
+        _, terms, _ = self._documents.pop(key)
+        for token in terms:
+            postings = self._postings[token]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[token]
+                self._terms = None
+
+    def _sorted_terms(self) -> List[str]:
+        if self._terms is None:
+            self._terms = sorted(self._postings)
+        return self._terms
+
+    def search(self, query: str, resource: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Returns the records matching every word of the query, best first. Each word also matches
+        longer tokens it is a prefix of ("dob" finds "Dobřany"), which score lower than exact ones.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self._lock:
+            terms = self._sorted_terms()
+            scores: Optional[Dict[DocKey, int]] = None
+            for word in dict.fromkeys(words):
+                matches: Dict[DocKey, int] = {}
+                start = bisect.bisect_left(terms, word)
+                for token in terms[start:bisect.bisect_left(terms, word + "\U0010ffff")]:
+                    bonus = EXACT_MATCH_BONUS if token == word else 1
+                    for key, weight in self._postings[token].items():
+                        if resource is None or key[0] == resource:
+                            matches[key] = max(matches.get(key, 0), weight * bonus)
+                scores = matches if scores is None else {k: s + matches[k] for k, s in scores.items() if k in matches}
+                if not scores:
+                    return []
+            ranked = sorted(scores.items(), key=lambda kv: (-kv[1], fold(self._documents[kv[0]][2]['title']), str(kv[0])))
+            return [{**self._documents[key][2], 'score': score} for key, score in ranked[:limit]]
+
+    def to_static(self) -> bytes:
+        """
+        A compact JSON form of the index for client-side search (see assets/js/search.js):
+        'docs' lists [resource, id, title, image] and 'terms' maps each token to a flat list of
+        [document position, weight, ...] pairs.
+        """
+        with self._lock:
+            keys = sorted(self._documents, key=lambda key: (key[0], str(key[1])))
+            positions = {key: n for n, key in enumerate(keys)}
+            docs = []
+            for key in keys:
+                summary = self._documents[key][2]
+                docs.append([summary['resource'], summary['id'], summary['title'], summary['image']])
+            terms = {}
+            for token in self._sorted_terms():
+                pairs = sorted((positions[key], weight) for key, weight in self._postings[token].items())
+                terms[token] = [value for pair in pairs for value in pair]
+        index = {'version': STATIC_INDEX_VERSION, 'exact_bonus': EXACT_MATCH_BONUS, 'docs': docs, 'terms': terms}
+        return json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,180 @@
+#! python3
+import os
+import re
+import gzip
+import hashlib
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; only .gz siblings are written without it.
+    brotli = None
+
+# --- Configuration ---
+BASE_DIR = Path(__file__).resolve().parent
+# Included from nginx.conf; hidden from the public site like every dotfile.
+NGINX_INCLUDE_PATH = BASE_DIR / ".nginx" / "static-cache.conf"
+FINGERPRINT_LENGTH = 10
+FINGERPRINT_EXTENSIONS = {".css", ".js", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico"}
+PRECOMPRESS_EXTENSIONS = {".html", ".css", ".js", ".svg", ".json"}
+HTML_MAX_AGE = 60
+ASSET_MAX_AGE = 31536000
+
+# Local src/href references, e.g. href="assets/css/main.css" (absolute and external URLs are skipped).
+ASSET_REFERENCE = re.compile(r'''(?P<attr>\b(?:src|href)=)(?P<quote>["'])(?P<path>(?![a-z]+:|/|#)[^"'?#]+)(?P=quote)''')
+
+
+# --- Helpers ---
+def write_atomic(path: Path, content: bytes):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def fingerprinted_name(path: Path, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+    return f"{path.stem}.{digest}{path.suffix}"
+
+
+# --- Precompression ---
+def precompress(path: Path, force: bool = False):
+    """
+    Writes .gz (and, with brotli installed, .br) siblings of a file for nginx's
+    gzip_static/brotli_static. Siblings newer than the file are left alone.
+    """
+    if path.suffix.lower() not in PRECOMPRESS_EXTENSIONS:
+        return
+    mtime = path.stat().st_mtime_ns
+    content = None
+    siblings = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        siblings.append((".br", lambda data: brotli.compress(data, quality=11)))
+    for suffix, compress in siblings:
+        target = path.with_name(path.name + suffix)
+        if not force and target.is_file() and target.stat().st_mtime_ns >= mtime:
+            continue
+        if content is None:
+            content = path.read_bytes()
+        write_atomic(target, compress(content))
+
+
+def remove_compressed(path: Path):
+    """Removes precompressed siblings, which nginx would otherwise keep serving."""
+    for suffix in (".gz", ".br"):
+        try:
+            path.with_name(path.name + suffix).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def remove_with_siblings(path: Path):
+    remove_compressed(path)
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# --- Fingerprinting ---
+def find_asset_references(source: str, base_dir: Path):
+    """Returns the local files referenced through src/href in a template source that exist under base_dir."""
+    paths = set()
+    for match in ASSET_REFERENCE.finditer(source):
+        path = match.group("path")
+        if "{" in path or Path(path).suffix.lower() not in FINGERPRINT_EXTENSIONS:
+            continue
+        if (base_dir / path).is_file():
+            paths.add(path)
+    return sorted(paths)
+
+
+def fingerprint_assets(paths, base_dir: Path, previous=None):
+    """
+    Copies every asset to a content-hashed name next to the original (so relative URLs
+    inside CSS keep working) and returns {original path: fingerprinted path}.
+    Copies recorded in `previous` that are no longer current are removed.
+    """
+    previous = previous or {}
+    assets = {}
+    for path in paths:
+        source = base_dir / path
+        content = source.read_bytes()
+        hashed = Path(path).with_name(fingerprinted_name(source, content)).as_posix()
+        target = base_dir / hashed
+        if not target.is_file():
+            write_atomic(target, content)
+        precompress(target)
+        assets[path] = hashed
+    for path, hashed in previous.items():
+        if assets.get(path) != hashed:
+            remove_with_siblings(base_dir / hashed)
+    return assets
+
+
+def rewrite_asset_urls(html: str, assets) -> str:
+    """Points src/href references at the fingerprinted copies."""
+    if not assets:
+        return html
+
+    def replace(match):
+        hashed = assets.get(match.group("path"))
+        if hashed is None:
+            return match.group(0)
+        return f"{match.group('attr')}{match.group('quote')}{hashed}{match.group('quote')}"
+
+    return ASSET_REFERENCE.sub(replace, html)
+
+
+# --- nginx Include ---
+def render_nginx_include() -> str:
+    extensions = "|".join(sorted(ext.lstrip(".") for ext in FINGERPRINT_EXTENSIONS))
+    immutable = f'add_header Cache-Control "public, max-age={ASSET_MAX_AGE}, immutable";'
+    return f"""# Generated by build.py; do not edit. Included from the server block in nginx.conf.
+
+# Fingerprinted assets never change under the same name.
+location ~* "\\.[0-9a-f]{{{FINGERPRINT_LENGTH}}}\\.(?:{extensions})$" {{
+    {immutable}
+    try_files $uri =404;
+}}
+
+# Responsive image derivatives are content-addressed (see derivatives.py).
+location ^~ /images/_derivatives/ {{
+    {immutable}
+    try_files $uri =404;
+}}
+
+# JSON snapshots of the data (see build.py), readable from any origin. The copies with a
+# content hash in their name never change; the others are rewritten on every edit.
+location /data/ {{
+    add_header Access-Control-Allow-Origin "*";
+    add_header Cache-Control "public, max-age={HTML_MAX_AGE}, must-revalidate";
+    try_files $uri =404;
+
+    location ~ "\\.[0-9a-f]{{{FINGERPRINT_LENGTH}}}\\.json$" {{
+        add_header Access-Control-Allow-Origin "*";
+        {immutable}
+        try_files $uri =404;
+    }}
+}}
+
+# Pages are rebuilt on every edit, so they are only cached briefly.
+location ~* \\.html$ {{
+    add_header Cache-Control "public, max-age={HTML_MAX_AGE}, must-revalidate";
+    try_files $uri =404;
+}}
+"""
+
+
+def write_nginx_include(path: Path = NGINX_INCLUDE_PATH):
+    content = render_nginx_include().encode("utf-8")
+    if path.is_file() and path.read_bytes() == content:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, content)
+
+
+if __name__ == "__main__":
+    # Run before nginx starts (see entrypoint.sh), as nginx only reads includes at startup.
+    write_nginx_include()
+    print(f"Wrote {NGINX_INCLUDE_PATH}")
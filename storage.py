@@ -0,0 +1,457 @@
+#! python3
+import os
+import sys
+import json
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import time
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only serialize the threads of one process
+    fcntl = None
+
+# --- Configuration ---
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent / "src" / "data"
+# "json" keeps every resource in its own JSON file; "sqlite" keeps them all in one SQLite
+# database (see SqliteRepository). Import the JSON files first with `python3 storage.py import`.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+# Defaults to content.sqlite3 next to the JSON files.
+SQLITE_PATH = os.environ.get("SQLITE_PATH")
+SQLITE_FILENAME = "content.sqlite3"
+# Number of previous versions kept per data file, in <data dir>/.backups/<name>.<n> (JSON backend only)
+BACKUP_COUNT = int(os.environ.get("DATA_BACKUP_COUNT", "5"))
+
+T = TypeVar("T")
+
+
+class StorageError(Exception):
+    """Raised when a data file exists but cannot be read back as a JSON list."""
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    A parsed, indexed view of one version of a data file. Shared between readers,
+    so the records must be treated as read-only.
+    """
+    items: List[Dict[str, Any]]
+    by_id: Dict[int, Dict[str, Any]]
+    ordered: List[Dict[str, Any]]  # sorted by ('order', 'id'), ascending
+    keys: List[Tuple[Any, Any]]    # the ('order', 'id') key of each record in `ordered`
+    version: str                   # content hash of the file, usable as an ETag
+    modified: float                # file mtime, in seconds since the epoch
+    _derived: Dict[str, Any] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_items(cls, items: List[Dict[str, Any]], version: str, modified: float) -> "Snapshot":
+        by_id = {}
+        for item in items:
+            by_id.setdefault(item.get('id'), item)
+        keyed = sorted(((item.get('order', 0), item.get('id') or 0), n) for n, item in enumerate(items))
+        ordered = [items[n] for _, n in keyed]
+        return cls(items, by_id, ordered, [key for key, _ in keyed], version, modified)
+
+    def derived(self, name: str, compute: Callable[["Snapshot"], T]) -> T:
+        """
+        Returns compute(self), computed once per snapshot. Used for indexes and serialized
+        views, which are then dropped together with the version they were built from.
+        """
+        if name not in self._derived:
+            self._derived[name] = compute(self)
+        return self._derived[name]
+
+
+class FileLock:
+    """
+    A reentrant lock held across the threads of this process and, through flock() on `path`,
+    across processes (e.g. the workers of `uvicorn --workers N`, or a command-line build).
+    The lock file itself is never replaced, unlike the data files it guards.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._file = self._lock_file(blocking)
+            except BaseException:
+                self._lock.release()
+                raise
+            if self._file is None:
+                self._lock.release()
+                return False
+        self._depth += 1
+        return True
+
+    def _lock_file(self, blocking: bool):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, "a")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            # Closing the file releases the flock.
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _fsync_directory(directory: Path):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JsonRepository:
+    """
+    A list of records stored as one JSON file (the format build.py reads).
+    Writers are serialized per file, across threads and processes (through a FileLock on
+    .<name>.lock next to the file), every save goes to a temp file that is fsynced and
+    atomically renamed over the original, and the previous versions are kept as backups.
+    Readers in other processes see a save through snapshot(), which checks the file's stat.
+    Use get_repository() so all callers share the instance (and lock) for a file.
+    """
+
+    def __init__(self, path: Path, backups: int = BACKUP_COUNT):
+        self.path = path
+        self.backups = backups
+        self.backup_dir = path.parent / ".backups"
+        self._lock = FileLock(path.parent / f".{path.name}.lock")
+        self._snapshot: Optional[Snapshot] = None
+        self._snapshot_key = None
+
+    def _read(self):
+        """Returns (records, content hash, stat) of the file as it is on disk."""
+        with metrics.DATA_LOAD_SECONDS.labels(file=self.path.name).time():
+            return self._read_file()
+
+    def _read_file(self):
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                raw = f.read()
+        except FileNotFoundError:
+            return [], "empty", None
+        except OSError as e:
+            raise StorageError(f"Could not read {self.path.name}: {e}") from e
+        try:
+            data = json.loads(raw.decode('utf-8'))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise StorageError(f"Could not read {self.path.name}: {e}") from e
+        if not isinstance(data, list):
+            raise StorageError(f"{self.path.name} does not contain a JSON list")
+        return data, hashlib.sha256(raw).hexdigest()[:32], stat
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Returns a fresh copy of the stored records; a missing file is an empty list, a corrupt one an error."""
+        return self._read()[0]
+
+    def snapshot(self) -> Snapshot:
+        """
+        Returns the cached, indexed view of the file. It is rebuilt after this repository
+        writes, or when the file's inode, mtime or size changed (edits made outside the API).
+        """
+        try:
+            key = _stat_key(os.stat(self.path))
+        except FileNotFoundError:
+            key = None
+        snapshot = self._snapshot
+        if snapshot is not None and key == self._snapshot_key:
+            return snapshot
+        data, version, stat = self._read()
+        # Keyed by the stat of the file that was actually read, so a concurrent replace
+        # simply causes another reload on the next call.
+        snapshot = Snapshot.from_items(data, version, stat.st_mtime if stat else 0.0)
+        self._snapshot, self._snapshot_key = snapshot, _stat_key(stat) if stat else None
+        return snapshot
+
+    def save(self, data: List[Dict[str, Any]]):
+        with self._lock, metrics.DATA_SAVE_SECONDS.labels(file=self.path.name).time():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._rotate_backups()
+                os.replace(tmp_name, self.path)
+            except BaseException:
+                try:
+                    os.remove(tmp_name)
+                except OSError:
+                    pass
+                raise
+            finally:
+                self._snapshot = None
+            _fsync_directory(self.path.parent)
+
+    def update(self, mutate: Callable[[List[Dict[str, Any]]], T]) -> T:
+        """
+        Runs a load-modify-save cycle under the file's lock. `mutate` changes the list in
+        place; its return value is passed through. Nothing is saved if it raises.
+        """
+        with self._lock:
+            data = self.load()
+            result = mutate(data)
+            self.save(data)
+            return result
+
+    def _rotate_backups(self):
+        if self.backups <= 0 or not self.path.is_file():
+            return
+        self.backup_dir.mkdir(exist_ok=True)
+        for n in range(self.backups - 1, 0, -1):
+            older = self.backup_dir / f"{self.path.name}.{n}"
+            if older.exists():
+                os.replace(older, self.backup_dir / f"{self.path.name}.{n + 1}")
+        newest = self.backup_dir / f"{self.path.name}.1"
+        newest.unlink(missing_ok=True)
+        # The current file is about to be replaced by a rename, so a hard link preserves it for free.
+        try:
+            os.link(self.path, newest)
+        except OSError:
+            shutil.copy2(self.path, newest)
+
+
+# --- SQLite Backend ---
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    resource TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    "order" NUMERIC NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (resource, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS records_order ON records (resource, "order", id);
+CREATE TABLE IF NOT EXISTS versions (
+    resource TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_connections = threading.local()
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    """Returns this thread's connection to a database, creating the database on first use."""
+    connections = _connections.__dict__.setdefault("by_path", {})
+    if path not in connections:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly with BEGIN.
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SQLITE_SCHEMA)
+        connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', ?)", (uuid.uuid4().hex,))
+        connections[path] = connection
+    return connections[path]
+
+
+class SqliteRepository:
+    """
+    The records of one resource, stored in a SQLite database in WAL mode with the same
+    interface as JsonRepository. Each record is kept as JSON next to indexed id and order
+    columns. update() runs in one transaction and only writes the rows that changed, so a
+    multi-row change such as a reorder is applied completely or not at all.
+    Every write bumps the resource's version, which invalidates snapshots in all processes.
+    """
+
+    def __init__(self, path: Path, resource: str):
+        self.path = path
+        self.resource = resource
+        self._lock = threading.RLock()
+        self._snapshot: Optional[Snapshot] = None
+        self._snapshot_key = None
+
+    def _version(self, connection):
+        row = connection.execute(
+            "SELECT meta.value, versions.version, versions.modified FROM meta "
+            "LEFT JOIN versions ON versions.resource = ? WHERE meta.key = 'instance'", (self.resource,)
+        ).fetchone()
+        return (row[0], row[1] or 0), row[2] or 0.0
+
+    def _rows(self, connection):
+        return connection.execute(
+            'SELECT id, data FROM records WHERE resource = ? ORDER BY "order", id', (self.resource,)
+        ).fetchall()
+
+    def _read(self):
+        """Returns (records, version key, modified time) as one consistent read."""
+        with metrics.DATA_LOAD_SECONDS.labels(file=f"{self.path.name}:{self.resource}").time():
+            connection = _connect(self.path)
+            try:
+                connection.execute("BEGIN")
+                key, modified = self._version(connection)
+                rows = self._rows(connection)
+                connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                if connection.in_transaction: connection.execute("ROLLBACK")
+                raise StorageError(f"Could not read {self.resource} from {self.path.name}: {e}") from e
+            return [json.loads(data) for _, data in rows], key, modified
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Returns a fresh copy of the stored records, sorted by ('order', 'id')."""
+        return self._read()[0]
+
+    def snapshot(self) -> Snapshot:
+        """Returns the cached, indexed view of the records, rebuilt when the resource's version changed."""
+        try:
+            key, _ = self._version(_connect(self.path))
+        except sqlite3.Error as e:
+            raise StorageError(f"Could not read {self.resource} from {self.path.name}: {e}") from e
+        snapshot = self._snapshot
+        if snapshot is not None and key == self._snapshot_key:
+            return snapshot
+        data, key, modified = self._read()
+        snapshot = Snapshot.from_items(data, f"{key[0][:12]}-{key[1]}", modified)
+        self._snapshot, self._snapshot_key = snapshot, key
+        return snapshot
+
+    def save(self, data: List[Dict[str, Any]]):
+        """Replaces all records of the resource."""
+        self._write(lambda existing: data)
+
+    def update(self, mutate: Callable[[List[Dict[str, Any]]], T]) -> T:
+        """
+        Runs a load-modify-save cycle in one transaction. `mutate` changes the list in place;
+        its return value is passed through. Nothing is saved if it raises.
+        """
+        result = []
+
+        def apply(data):
+            result.append(mutate(data))
+            return data
+
+        self._write(apply)
+        return result[0]
+
+    def _write(self, produce):
+        with self._lock, metrics.DATA_SAVE_SECONDS.labels(file=f"{self.path.name}:{self.resource}").time():
+            connection = _connect(self.path)
+            try:
+                # IMMEDIATE takes the write lock up front, which serializes writers across processes.
+                connection.execute("BEGIN IMMEDIATE")
+                existing = dict(self._rows(connection))
+                data = produce([json.loads(text) for text in existing.values()])
+                rows = {}
+                for item in data:
+                    if not isinstance(item.get('id'), int):
+                        raise StorageError(f"{self.resource} records need an integer 'id'")
+                    rows[item['id']] = (item.get('order', 0), json.dumps(item, ensure_ascii=False))
+                removed = [(self.resource, item_id) for item_id in existing.keys() - rows.keys()]
+                changed = [(self.resource, item_id, order, text) for item_id, (order, text) in rows.items()
+                           if existing.get(item_id) != text]
+                if removed or changed:
+                    connection.executemany("DELETE FROM records WHERE resource = ? AND id = ?", removed)
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO records (resource, id, "order", data) VALUES (?, ?, ?, ?)', changed)
+                    connection.execute(
+                        "INSERT INTO versions (resource, version, modified) VALUES (?, 1, ?) "
+                        "ON CONFLICT (resource) DO UPDATE SET version = version + 1, modified = excluded.modified",
+                        (self.resource, time.time()))
+                connection.execute("COMMIT")
+            except BaseException as e:
+                if connection.in_transaction: connection.execute("ROLLBACK")
+                if isinstance(e, sqlite3.Error):
+                    raise StorageError(f"Could not write {self.resource} to {self.path.name}: {e}") from e
+                raise
+            finally:
+                self._snapshot = None
+
+
+_repositories: Dict[Path, Any] = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(path: Path):
+    """
+    Returns the process-wide repository for a data file (e.g. src/data/paintings.json).
+    With the SQLite backend, the file's stem names the resource in the database.
+    """
+    key = path.resolve()
+    with _repositories_lock:
+        if key not in _repositories:
+            if STORAGE_BACKEND == "json":
+                _repositories[key] = JsonRepository(key)
+            elif STORAGE_BACKEND == "sqlite":
+                database = Path(SQLITE_PATH).resolve() if SQLITE_PATH else key.parent / SQLITE_FILENAME
+                _repositories[key] = SqliteRepository(database, key.stem)
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        return _repositories[key]
+
+
+# --- Import & Export ---
+def _sqlite_path(data_dir: Path) -> Path:
+    return Path(SQLITE_PATH).resolve() if SQLITE_PATH else data_dir.resolve() / SQLITE_FILENAME
+
+
+def import_json(data_dir: Path = DEFAULT_DATA_DIR):
+    """Copies every <data_dir>/*.json file into the SQLite database, replacing its records."""
+    database = _sqlite_path(data_dir)
+    for json_path in sorted(data_dir.glob("*.json")):
+        items = JsonRepository(json_path).load()
+        SqliteRepository(database, json_path.stem).save(items)
+        print(f"Imported {len(items)} records from {json_path.name} into {database.name}")
+
+
+def export_json(data_dir: Path = DEFAULT_DATA_DIR):
+    """Writes the SQLite records back to <data_dir>/*.json (with backups), e.g. to switch back to the JSON backend."""
+    database = _sqlite_path(data_dir)
+    connection = _connect(database)
+    resources = [row[0] for row in connection.execute("SELECT DISTINCT resource FROM records ORDER BY resource")]
+    for resource in resources:
+        items = SqliteRepository(database, resource).load()
+        JsonRepository(data_dir / f"{resource}.json").save(items)
+        print(f"Exported {len(items)} {resource} records to {resource}.json")
+
+
+if __name__ == "__main__":
+    commands = {"import": import_json, "export": export_json}
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in commands:
+        print("Usage: python3 storage.py import|export [data dir]")
+        sys.exit(1)
+    commands[sys.argv[1]](Path(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_DATA_DIR)
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import shutil
+import subprocess
+from pathlib import Path
+
+from PIL import Image
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+# scripts/ingest.py and the modules it imports, copied into a scratch tree per test.
+MODULES = ("scripts/ingest.py", "image_metadata.py", "storage.py", "metrics.py")
+
+
+def make_tree(root: Path):
+    for module in MODULES:
+        (root / module).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(REPO_DIR / module, root / module)
+    (root / "src" / "data").mkdir(parents=True)
+    (root / "src" / "data" / "paintings.json").write_text("[]", encoding="utf-8")
+    (root / "images" / "obrazy").mkdir(parents=True)
+
+
+def run_ingest(root: Path, *args):
+    env = {**os.environ, "STORAGE_BACKEND": "json"}
+    return subprocess.run([sys.executable, str(root / "scripts" / "ingest.py"), *args],
+                          cwd=root, env=env, capture_output=True, text=True, check=True)
+
+
+def test_move_keeps_unreadable_sources(tmp_path):
+    root, source_dir = tmp_path / "site", tmp_path / "import"
+    make_tree(root)
+    source_dir.mkdir()
+    Image.new("RGB", (8, 8), "red").save(source_dir / "Kvetiny.png")
+    (source_dir / "broken.jpg").write_bytes(b"not an image")
+
+    result = run_ingest(root, str(source_dir), "--move", "--workers", "1")
+
+    assert "Skipping 'broken.jpg'" in result.stdout
+    assert (source_dir / "broken.jpg").read_bytes() == b"not an image"
+    assert not (source_dir / "Kvetiny.png").exists()
+    records = json.loads((root / "src" / "data" / "paintings.json").read_text(encoding="utf-8"))
+    assert [record["title"] for record in records] == ["Kvetiny"]
+    assert (root / "images" / "obrazy" / records[0]["filename"]).is_file()
+
+
+def test_move_after_interrupted_commit_removes_only_imported_sources(tmp_path):
+    root, source_dir = tmp_path / "site", tmp_path / "import"
+    make_tree(root)
+    source_dir.mkdir()
+    Image.new("RGB", (8, 8), "red").save(source_dir / "Kvetiny.png")
+    (source_dir / "broken.jpg").write_bytes(b"not an image")
+    journal = [
+        {"resource": "paintings"},
+        {"file": "Kvetiny.png", "sha256": "0" * 64},
+        {"file": "broken.jpg", "error": "cannot identify image file"},
+        {"committed": True, "ids": [1], "files": ["Kvetiny.png"]},
+    ]
+    (source_dir / ".ingest-paintings.journal").write_text("".join(json.dumps(line) + "\n" for line in journal))
+
+    result = run_ingest(root, str(source_dir), "--move")
+
+    assert "already committed" in result.stdout
+    assert not (source_dir / "Kvetiny.png").exists()
+    assert (source_dir / "broken.jpg").exists()
+    assert not (source_dir / ".ingest-paintings.journal").exists()